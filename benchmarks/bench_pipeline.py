@@ -0,0 +1,269 @@
+# Micro-benchmarks for the generation pipeline, driven by the offline fake model.
+#
+#   python benchmarks/bench_pipeline.py --out results.json
+#   python benchmarks/bench_pipeline.py --sizes 1,100,10000 --latency 0.2 --compare results.json
+#
+# Every result records per-stage seconds (median of --repeat runs), throughput, the peak
+# traced memory and the net number of allocated blocks of one extra run under tracemalloc.
+# --compare exits with status 1 when any result got slower than --threshold allows.
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Stores and exports go to a throw-away directory that is removed when the run ends
+work_dir = tempfile.TemporaryDirectory(prefix='fake_frenzy_bench_')
+WORK_DIR = work_dir.name
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the generation pipeline against the fake model')
+    parser.add_argument('--sizes', default='1,10,100,1000,10000,100000', help='Comma-separated batch sizes')
+    parser.add_argument('--modes', default='regular,fantasy', help='Record modes for the per-stage pipeline benchmark')
+    parser.add_argument('--formats', default='jsonl', help='Comma-separated export formats to time')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the fake model waits per call')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--story-max', type=int, default=1000, help='Largest number of stories generated in one run')
+    parser.add_argument('--only', default=None, help='Comma-separated benchmark names to run')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc run')
+    parser.add_argument('--out', default=None, help='Write the JSON results here instead of stdout')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before --compare fails')
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    args.modes = args.modes.split(',')
+    args.formats = args.formats.split(',')
+    args.only = set(args.only.split(',')) if args.only else None
+    return args
+
+
+args = parse_args(sys.argv[1:])
+
+# main reads its settings at import time, so the fake model and throw-away stores are set up first
+os.environ.update({
+    'MODEL_BACKEND': 'fake',
+    'FAKE_MODEL_LATENCY': str(args.latency),
+    'FAKE_MODEL_FAILURE_RATE': '0',
+    'FAKE_MODEL_TRUNCATION_RATE': '0',
+    'FAKE_MODEL_INVALID_RATE': '0',
+    'REGULAR_GENERATOR': 'model',
+    'MODEL_RPM': str(10 ** 9),
+    'MODEL_TPM': str(10 ** 12),
+    'WARM_POOL_DEPTH': '0',
+    'LOG_LEVEL': 'ERROR',
+    'HISTORY_DB_PATH': os.path.join(WORK_DIR, 'history.db'),
+    'DATASET_DIR': os.path.join(WORK_DIR, 'datasets'),
+})
+os.environ.pop('CACHE_DB_PATH', None)
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+from nicegui import Client, ui  # noqa: E402
+from nicegui.page import page  # noqa: E402
+
+render_client = Client(page('/benchmark'))
+
+
+class Stages:
+    # Collects named stage timings for one run
+    def __init__(self):
+        self.seconds = {}
+
+    def time(self, name):
+        stages = self
+
+        class Timer:
+            def __enter__(self):
+                self.started = time.perf_counter()
+
+            def __exit__(self, *exc):
+                stages.seconds[name] = stages.seconds.get(name, 0) + time.perf_counter() - self.started
+
+        return Timer()
+
+
+def render(people, mode):
+    # The same elements the result dialog builds, on a client no browser is attached to
+    with render_client:
+        with ui.column() as column:
+            for index, person in enumerate(people):
+                main.render_person(person, index, mode)
+    column.delete()
+    # Nothing drains the outbox without a browser, so drop the updates a socket would have sent
+    render_client.outbox.updates.clear()
+
+
+async def export(people, formats, stages):
+    with render_client:
+        for format_type in formats:
+            with stages.time(f'export_{format_type}'):
+                await main.export_data({"people": people}, format_type, name=os.path.join(WORK_DIR, 'bench'))
+
+
+async def pipeline(mode, size, formats, stages):
+    ui_mode = {'regular': 'Regular', 'fantasy': 'Fantasy Mode', 'surprise': 'Surprise'}.get(mode, mode)
+    with stages.time('prompt'):
+        prompt = main.build_people_prompt(mode, size)
+    with stages.time('model'):
+        response = await main.generate_content(prompt, mode=mode, count=size, use_cache=False)
+    with stages.time('parse'):
+        data = main.normalize_people(main.parse_json_response(response.text))
+    with stages.time('validate'):
+        people = main.validate_records(mode, data['people'])
+    # Like the result dialog, only the preview is rendered
+    with stages.time('render'):
+        render(people[:main.DIALOG_PREVIEW_ENTRIES], ui_mode)
+    await export(people, formats, stages)
+    return len(people)
+
+
+async def run_generate_fake_data(size, stages):
+    with stages.time('total'):
+        data = await main.generate_fake_data(count=size, use_cache=False)
+    return len(data['people'])
+
+
+async def run_generate_fantasy_data(size, stages):
+    with stages.time('total'):
+        data = await main.generate_fantasy_data(count=size, use_cache=False)
+    return len(data['people'])
+
+
+async def run_process_response(size, stages):
+    text = main.backend.build_response(main.build_people_prompt('regular', size), 'regular', size)
+    with stages.time('total'):
+        data = main.process_response(main.ModelResponse(text))
+    return len(data['people'])
+
+
+async def run_generate_character_story(size, stages):
+    characters = main.FakeBackend(seed=size).build_response('', 'regular', size)
+    characters = json.loads(characters)['people']
+    with stages.time('total'):
+        stories = await asyncio.gather(*(main.generate_character_story(person, use_cache=False) for person in characters))
+    return len(stories)
+
+
+def benchmark_cases():
+    for mode in args.modes:
+        for size in args.sizes:
+            yield 'pipeline', mode, size, lambda stages, mode=mode, size=size: pipeline(mode, size, args.formats, stages)
+    for size in args.sizes:
+        yield 'generate_fake_data', 'regular', size, lambda stages, size=size: run_generate_fake_data(size, stages)
+        yield 'generate_fantasy_data', 'fantasy', size, lambda stages, size=size: run_generate_fantasy_data(size, stages)
+        yield 'process_response', 'regular', size, lambda stages, size=size: run_process_response(size, stages)
+        if size <= args.story_max:
+            yield 'generate_character_story', 'story', size, lambda stages, size=size: run_generate_character_story(size, stages)
+
+
+async def measure(run):
+    runs = []
+    records = 0
+    for _ in range(args.repeat):
+        gc.collect()
+        stages = Stages()
+        started = time.perf_counter()
+        records = await run(stages)
+        stages.seconds.setdefault('total', time.perf_counter() - started)
+        runs.append(stages.seconds)
+    seconds = {name: statistics.median(run_seconds[name] for run_seconds in runs) for name in runs[0]}
+    result = {
+        'stages': {name: round(value, 6) for name, value in seconds.items() if name != 'total'},
+        'seconds': round(seconds['total'], 6),
+        'records': records,
+        'records_per_second': round(records / max(seconds['total'], 1e-9), 1),
+    }
+
+    if not args.no_memory:
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        try:
+            await run(Stages())
+            result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        result['allocated_blocks'] = sys.getallocatedblocks() - blocks
+    return result
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {(r['name'], r['mode'], r['size']): r for r in json.load(f)['results']}
+    regressions = 0
+    for result in results:
+        before = baseline.get((result['name'], result['mode'], result['size']))
+        if not before:
+            continue
+        ratio = result['seconds'] / max(before['seconds'], 1e-9)
+        slower = ratio > 1 + threshold
+        regressions += slower
+        print(
+            f"{'REGRESSION' if slower else 'ok':>10}  {result['name']:<26} {result['mode']:<8} {result['size']:>7}  "
+            f"{before['seconds']:.4f}s -> {result['seconds']:.4f}s ({ratio:.2f}x)",
+            file=sys.stderr
+        )
+    return regressions
+
+
+async def run_benchmarks():
+    results = []
+    for name, mode, size, run in benchmark_cases():
+        if args.only and name not in args.only:
+            continue
+        result = {'name': name, 'mode': mode, 'size': size, **await measure(run)}
+        results.append(result)
+        print(f"{name:<26} {mode:<8} {size:>7}  {result['seconds']:.4f}s  {result['records_per_second']:,.0f} records/s",
+              file=sys.stderr)
+    return results
+
+
+def main_benchmark():
+    started_at = datetime.now(timezone.utc).isoformat()
+    try:
+        results = asyncio.run(run_benchmarks())
+    finally:
+        work_dir.cleanup()
+    report = {
+        'suite': 'pipeline',
+        'version': {'git': git_version(), 'prompt_version': main.PROMPT_VERSION},
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': started_at,
+        'config': {
+            'sizes': args.sizes, 'modes': args.modes, 'formats': args.formats, 'latency': args.latency,
+            'repeat': args.repeat, 'story_pipeline': main.STORY_PIPELINE, 'memory': not args.no_memory
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_benchmark()
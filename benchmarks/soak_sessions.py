@@ -0,0 +1,494 @@
+# Soak test: many simulated browser sessions on one NiceGUI process, answered by the fake model.
+#
+#   python benchmarks/soak_sessions.py --steps 10,25,50,100,200 --step-seconds 30 --out soak.json
+#   python benchmarks/soak_sessions.py --url http://localhost:8080 --pid 1234 --steps 50
+#
+# Each session loads main_page, connects its socket the way the browser does and then, with a
+# think time in between, clicks Generate Data, favorites the result, closes the dialog, switches
+# tabs and clicks Surprise Me!. Sessions are added step by step until a step breaks one of the
+# --max-* limits, a socket drops or the server exits; that step is reported as the breaking point.
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+
+import aiohttp
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABS = ['Favorites', 'History', 'Settings', 'Generate']
+SCHEDULE = ['generate', 'favorite', 'close', 'tab', 'surprise', 'favorite', 'close', 'tab']
+CARD_HEADING = re.compile(r'^.+ \d+:$')
+HTML_ENTITIES = [('&#36;', '$'), ('&#96;', '`'), ('&gt;', '>'), ('&lt;', '<'), ('&amp;', '&')]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Ramp simulated browser sessions until the app falls over')
+    parser.add_argument('--url', default=None, help='Use a running server instead of starting main.py')
+    parser.add_argument('--pid', type=int, default=None, help='Server process to sample RSS from when --url is given')
+    parser.add_argument('--steps', default='5,10,25,50,100,200', help='Comma-separated session counts to ramp through')
+    parser.add_argument('--step-seconds', type=float, default=30)
+    parser.add_argument('--think', type=float, default=2.0, help='Mean seconds a session waits between actions')
+    parser.add_argument('--entries', type=int, default=5, help='Number of Entries each session generates')
+    parser.add_argument('--fresh', action='store_true', help='Turn on Always Generate Fresh Results so no click hits the cache')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds the fake model waits per call')
+    parser.add_argument('--action-timeout', type=float, default=30)
+    parser.add_argument('--sample-seconds', type=float, default=1.0, help='Interval of the RSS and lag timeline')
+    parser.add_argument('--max-rtt', type=float, default=1.0, help='Highest acceptable p95 UI round trip in seconds')
+    parser.add_argument('--max-lag', type=float, default=0.5, help='Highest acceptable p95 event-loop lag in seconds')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Highest acceptable share of failed actions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+    args.steps = [int(step) for step in args.steps.split(',')]
+    return args
+
+
+def quantiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'p50': round(pick(0.5), 4), 'p95': round(pick(0.95), 4), 'max': round(values[-1], 4), 'count': len(values)}
+
+
+def read_rss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+class Recorder:
+    # Everything the sessions observed during the current step
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rtt = {}
+        self.done = {}
+        self.page_loads = []
+        self.probes = []
+        self.harness_lag = []
+        self.disconnect_reasons = {}
+        self.stats = {'actions': 0, 'timeouts': 0, 'errors': 0, 'disconnects': 0, 'connect_failures': 0}
+
+    def action(self, name, rtt, done):
+        self.stats['actions'] += 1
+        self.rtt.setdefault(name, []).append(rtt)
+        self.done.setdefault(name, []).append(done)
+
+
+class SimulatedSession:
+    # One browser tab: the page's elements, its socket and the messages it is waiting for
+    def __init__(self, url, recorder, args, rng):
+        self.url = url
+        self.recorder = recorder
+        self.args = args
+        self.rng = rng
+        self.elements = {}
+        self.waiters = []
+        self.next_message_id = 0
+        self.alive = False
+        self.closing = False
+        self.http = None
+        self.sio = None
+
+    async def open(self):
+        started = time.perf_counter()
+        self.http = aiohttp.ClientSession()
+        # Like a browser, the socket gets its own connection instead of reusing the page's keep-alive one
+        async with self.http.get(self.url + '/', headers={'Connection': 'close'}) as response:
+            response.raise_for_status()
+            page = await response.text()
+        raw = re.search(r'parseElements\(String\.raw`(.*?)`\)', page, re.S).group(1)
+        for entity, char in HTML_ENTITIES:
+            raw = raw.replace(entity, char)
+        self.elements = json.loads(raw)
+        self.client_id = re.search(r"'client_id': '([^']+)'", page).group(1)
+
+        self.sio = socketio.AsyncClient(reconnection=False, http_session=self.http)
+        self.sio.on('*', self.on_message)
+        self.sio.on('disconnect', self.on_disconnect)
+        query = urllib.parse.urlencode({
+            'client_id': self.client_id, 'next_message_id': 0, 'implicit_handshake': 'true',
+            'tab_id': str(uuid.uuid4()), 'document_id': str(uuid.uuid4()),
+        })
+        await self.sio.connect(f'{self.url}?{query}', socketio_path='/_nicegui_ws/socket.io',
+                               transports=['websocket'], wait_timeout=self.args.action_timeout)
+        self.alive = True
+        self.recorder.page_loads.append(time.perf_counter() - started)
+        entries = self.find(props={'label': 'Number of Entries'})
+        if entries:
+            await self.emit(entries, 'update:modelValue', str(self.args.entries))
+        fresh = self.find(text='Always Generate Fresh Results')
+        if fresh and self.args.fresh:
+            await self.emit(fresh, 'update:modelValue', True)
+
+    async def close(self):
+        self.closing = True
+        if self.sio:
+            try:
+                await self.sio.disconnect()
+            except Exception:
+                pass
+        if self.http:
+            await self.http.close()
+
+    async def on_message(self, event, data=None):
+        if isinstance(data, dict) and '_id' in data:
+            self.next_message_id = data.pop('_id') + 1
+        if event == 'update':
+            for element_id, element in data.items():
+                if element is None:
+                    self.elements.pop(element_id, None)
+                else:
+                    self.elements[element_id] = element
+        now = time.perf_counter()
+        for waiter in list(self.waiters):
+            predicate, future = waiter
+            if not future.done() and predicate(event, data):
+                future.set_result(now)
+                self.waiters.remove(waiter)
+
+    async def on_disconnect(self, reason=None):
+        if self.alive and not self.closing:
+            self.recorder.stats['disconnects'] += 1
+            reasons = self.recorder.disconnect_reasons
+            reasons[str(reason)] = reasons.get(str(reason), 0) + 1
+        self.alive = False
+
+    def find(self, props=None, text=None, newer_than=-1):
+        # Newest matching element id, or None
+        for element_id in sorted(self.elements, key=int, reverse=True):
+            element = self.elements[element_id]
+            if int(element_id) <= newer_than:
+                break
+            if text is not None and element.get('text') != text:
+                continue
+            if props and any(element.get('props', {}).get(key) != value for key, value in props.items()):
+                continue
+            return element_id
+        return None
+
+    async def emit(self, element_id, event_type, *args):
+        element = self.elements[element_id]
+        listener = next(event['listener_id'] for event in element.get('events', []) if event['type'] == event_type)
+        await self.sio.emit('event', {
+            'id': int(element_id), 'client_id': self.client_id, 'listener_id': listener,
+            'args': [json.dumps(arg) for arg in args],
+        })
+
+    def wait_for(self, predicate):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((predicate, future))
+        return future
+
+    async def act(self, name, element_id, event_type, done, *args):
+        # Round trip is the first message back after the event; done is when the action's result arrived
+        first = self.wait_for(lambda event, data: True)
+        finished = self.wait_for(done)
+        started = time.perf_counter()
+        try:
+            await self.emit(element_id, event_type, *args)
+            await asyncio.wait_for(asyncio.shield(finished), self.args.action_timeout)
+            self.recorder.action(name, first.result() - started, finished.result() - started)
+        except asyncio.TimeoutError:
+            self.recorder.stats['timeouts'] += 1
+        finally:
+            self.waiters = [waiter for waiter in self.waiters if waiter[1] not in (first, finished)]
+
+    def first_card(self, newer_than):
+        # The dialog opens before the model answers; the action is done once the first result card arrives
+        def predicate(event, data):
+            return event == 'update' and any(
+                element and int(element_id) > newer_than and CARD_HEADING.match(element.get('text') or '')
+                for element_id, element in data.items()
+            )
+        return predicate
+
+    async def step(self, action):
+        newest = max(map(int, self.elements))
+        if action in ('generate', 'surprise'):
+            label = 'Generate Data' if action == 'generate' else '🎲 Surprise Me!'
+            await self.act(action, self.find(props={'label': label}), 'click', self.first_card(newest))
+        elif action == 'favorite':
+            button = self.find(props={'icon': 'favorite'})
+            if button:
+                notified = lambda event, data: event == 'notify' and 'favorites' in data.get('message', '')
+                await self.act(action, button, 'click', notified)
+        elif action == 'close':
+            button = self.find(props={'label': 'Close'})
+            if button:
+                await self.act(action, button, 'click', lambda event, data: event == 'update')
+        elif action == 'tab':
+            tabs = next(i for i, element in self.elements.items() if element.get('tag') == 'q-tabs')
+            panels = next(i for i, element in self.elements.items() if element.get('tag') == 'q-tab-panels')
+            current = self.elements[tabs].get('props', {}).get('model-value', 'Generate')
+            target = TABS[(TABS.index(current) + 1) % len(TABS)] if current in TABS else TABS[0]
+            self.elements[tabs].setdefault('props', {})['model-value'] = target
+            switched = lambda event, data: event == 'update' and panels in data
+            await self.act(action, tabs, 'update:modelValue', switched, target)
+
+    async def run(self):
+        position = self.rng.randrange(len(SCHEDULE))
+        acked = time.monotonic()
+        while not self.closing:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.think)
+            if not self.alive:
+                await self.reopen()
+                continue
+            action = SCHEDULE[position % len(SCHEDULE)]
+            position += 1
+            try:
+                await self.step(action)
+            except Exception:
+                if self.closing:
+                    break
+                self.recorder.stats['errors'] += 1
+            # The browser acknowledges received messages every few seconds so the server can prune its history
+            if time.monotonic() - acked > 3 and self.alive:
+                acked = time.monotonic()
+                await self.sio.emit('ack', {'client_id': self.client_id, 'next_message_id': self.next_message_id})
+
+    async def reopen(self):
+        # A browser reloads the page after losing its socket
+        await self.close()
+        self.closing = False
+        try:
+            await self.open()
+        except Exception:
+            self.recorder.stats['connect_failures'] += 1
+
+
+async def probe(url, recorder, baseline):
+    # Round trip of a trivial endpoint above its idle baseline approximates the server's event-loop lag
+    async with aiohttp.ClientSession() as http:
+        while True:
+            started = time.perf_counter()
+            try:
+                async with http.get(url + '/api/usage') as response:
+                    await response.read()
+                recorder.probes.append(max(0.0, time.perf_counter() - started - baseline))
+            except aiohttp.ClientError:
+                recorder.stats['errors'] += 1
+            await asyncio.sleep(0.2)
+
+
+async def watch_harness(recorder):
+    # The harness shares one loop with every session; if this lags, its own numbers are inflated
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(0.1)
+        recorder.harness_lag.append(time.perf_counter() - started - 0.1)
+
+
+async def server_stalls(url):
+    # Stalls the server's own event-loop watchdog has counted so far
+    async with aiohttp.ClientSession() as http:
+        async with http.get(url + '/metrics') as response:
+            text = await response.text()
+    return int(sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('fakefrenzy_loop_stalls_total')))
+
+
+async def measure_baseline(url):
+    async with aiohttp.ClientSession() as http:
+        samples = []
+        for _ in range(20):
+            started = time.perf_counter()
+            async with http.get(url + '/api/usage') as response:
+                await response.read()
+            samples.append(time.perf_counter() - started)
+            await asyncio.sleep(0.05)
+    return min(samples)
+
+
+def start_server(args, work_dir):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, **{
+        'MODEL_BACKEND': 'fake',
+        'FAKE_MODEL_LATENCY': str(args.latency),
+        'PORT': str(port),
+        'WARM_POOL_DEPTH': '0',
+        'LOG_LEVEL': 'WARNING',
+        'HISTORY_DB_PATH': os.path.join(work_dir, 'history.db'),
+        'DATASET_DIR': os.path.join(work_dir, 'datasets'),
+    })
+    log = open(os.path.join(work_dir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=work_dir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    return process, f'http://127.0.0.1:{port}'
+
+
+async def wait_until_up(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if process and process.poll() is not None:
+                raise SystemExit(f'The server exited with status {process.returncode} before it came up')
+            try:
+                async with http.get(url + '/api/usage') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise SystemExit(f'The server at {url} did not come up within {timeout} seconds')
+
+
+def summarize(sessions, recorder, samples, args):
+    stats = dict(recorder.stats)
+    rtt_all = [value for values in recorder.rtt.values() for value in values]
+    failed = stats['timeouts'] + stats['errors']
+    attempts = stats['actions'] + stats['timeouts']
+    summary = {
+        'sessions': sessions,
+        'alive': None,
+        **stats,
+        'disconnect_reasons': dict(recorder.disconnect_reasons),
+        'error_rate': round(failed / max(attempts, 1), 4),
+        'page_load_seconds': quantiles(recorder.page_loads),
+        'rtt_seconds': quantiles(rtt_all),
+        'rtt_seconds_by_action': {name: quantiles(values) for name, values in recorder.rtt.items()},
+        'done_seconds_by_action': {name: quantiles(values) for name, values in recorder.done.items()},
+        'loop_lag_seconds': quantiles(recorder.probes),
+        'harness_lag_seconds': quantiles(recorder.harness_lag),
+        'rss_bytes': quantiles([sample['rss_bytes'] for sample in samples if sample['rss_bytes']]),
+    }
+    reasons = []
+    if stats['disconnects'] or stats['connect_failures']:
+        reasons.append(f"{stats['disconnects']} disconnects, {stats['connect_failures']} failed connects")
+    if summary['error_rate'] > args.max_error_rate:
+        reasons.append(f"error rate {summary['error_rate']:.1%}")
+    if summary['rtt_seconds'] and summary['rtt_seconds']['p95'] > args.max_rtt:
+        reasons.append(f"p95 round trip {summary['rtt_seconds']['p95']:.2f}s")
+    if summary['loop_lag_seconds'] and summary['loop_lag_seconds']['p95'] > args.max_lag:
+        reasons.append(f"p95 loop lag {summary['loop_lag_seconds']['p95']:.2f}s")
+    summary['failures'] = reasons
+    return summary
+
+
+async def soak(args, url, process, pid):
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    baseline = await measure_baseline(url)
+    sessions = []
+    timeline = []
+    steps = []
+    breaking_point = None
+    background = [asyncio.create_task(probe(url, recorder, baseline)), asyncio.create_task(watch_harness(recorder))]
+    runners = []
+    started = time.perf_counter()
+    try:
+        for target in args.steps:
+            recorder.reset()
+            stalls = await server_stalls(url)
+            new = [SimulatedSession(url, recorder, args, random.Random(rng.random())) for _ in range(target - len(sessions))]
+            results = await asyncio.gather(*(session.open() for session in new), return_exceptions=True)
+            for session, result in zip(new, results):
+                if isinstance(result, Exception):
+                    recorder.stats['connect_failures'] += 1
+                runners.append(asyncio.create_task(session.run()))
+            sessions += new
+
+            step_samples = []
+            step_end = time.perf_counter() + args.step_seconds
+            while time.perf_counter() < step_end:
+                await asyncio.sleep(args.sample_seconds)
+                sample = {
+                    't': round(time.perf_counter() - started, 2),
+                    'sessions': sum(session.alive for session in sessions),
+                    'rss_bytes': read_rss(pid) if pid else None,
+                    'loop_lag_seconds': round(max(recorder.probes[-5:], default=0), 4),
+                    'harness_lag_seconds': round(max(recorder.harness_lag[-10:], default=0), 4),
+                }
+                step_samples.append(sample)
+                if process and process.poll() is not None:
+                    break
+
+            summary = summarize(target, recorder, step_samples, args)
+            summary['alive'] = sum(session.alive for session in sessions)
+            if process is None or process.poll() is None:
+                summary['server_loop_stalls'] = await server_stalls(url) - stalls
+            if process and process.poll() is not None:
+                summary['failures'].append(f'server exited with status {process.returncode}')
+            timeline += step_samples
+            steps.append(summary)
+            rtt = summary['rtt_seconds'] or {}
+            lag = summary['loop_lag_seconds'] or {}
+            print(f"{target:>5} sessions  {summary['actions']:>6} actions  rtt p95 {rtt.get('p95', 0):.3f}s  "
+                  f"lag p95 {lag.get('p95', 0):.3f}s  {summary['disconnects']} disconnects  "
+                  f"{'FAIL: ' + '; '.join(summary['failures']) if summary['failures'] else 'ok'}", file=sys.stderr)
+            if summary['failures']:
+                breaking_point = target
+                break
+    finally:
+        for session in sessions:
+            session.closing = True
+        for task in runners + background:
+            task.cancel()
+        await asyncio.gather(*runners, *background, return_exceptions=True)
+        await asyncio.gather(*(session.close() for session in sessions), return_exceptions=True)
+    return {'baseline_probe_seconds': round(baseline, 4), 'steps': steps, 'timeline': timeline,
+            'breaking_point': breaking_point}
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    started_at = datetime.now(timezone.utc).isoformat()
+    process = None
+    work_dir = tempfile.mkdtemp(prefix='fake_frenzy_soak_')
+    if args.url:
+        url, pid = args.url.rstrip('/'), args.pid
+    else:
+        process, url = start_server(args, work_dir)
+        pid = process.pid
+    try:
+        asyncio.run(wait_until_up(url, process))
+        result = asyncio.run(soak(args, url, process, pid))
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    report = {
+        'suite': 'soak',
+        'started_at': started_at,
+        'url': url,
+        'config': {key: value for key, value in vars(args).items() if key not in ('out', 'url', 'pid')},
+        **result,
+    }
+    if process:
+        report['server_log'] = os.path.join(work_dir, 'server.log')
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if result['breaking_point']:
+        print(f"The app fell over at {result['breaking_point']} sessions", file=sys.stderr)
+    else:
+        print(f'No step failed; the app held {args.steps[-1]} sessions', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,161 @@
-from nicegui import ui
+from nicegui import ui, app
+from fastapi import HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
+import sys
+import argparse
 from dotenv import load_dotenv
 import json
+import logging
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from datetime import datetime
 import csv
 import asyncio
+import gzip
+import itertools
+import hashlib
+import random
+import re
+import secrets
+import shutil
+import sqlite3
+import string
+import threading
+import time
+import traceback
+import unicodedata
+import weakref
+from functools import lru_cache
+from collections import OrderedDict, deque
 
 # Load environment variables from .env file
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-genai.configure(api_key=GEMINI_API_KEY)
-
-
-model = genai.GenerativeModel('gemini-1.5-flash')
-
-
-num_entries = 1  
-
-
-saved_favorites = []
-generation_history = []
-export_format = 'json'  
-max_history_entries = 50  
-
-
-favorites_container = ui.column().classes('w-full')
-history_container = ui.column().classes('w-full')
-
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('fake_frenzy')
 
-mode = None
-fantasy_type_select = None
-era = None
-universe_type = None
-reality_type = None
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+
+# Model backend: 'gemini', 'fake' (offline stand-in), 'record' or 'replay' (cassette)
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'gemini')
+CASSETTE_PATH = os.getenv('CASSETTE_PATH', 'cassette.jsonl')
+FAKE_MODEL_LATENCY = float(os.getenv('FAKE_MODEL_LATENCY', 0.5))
+FAKE_MODEL_FAILURE_RATE = float(os.getenv('FAKE_MODEL_FAILURE_RATE', 0))
+FAKE_MODEL_SEED = int(os.getenv('FAKE_MODEL_SEED', 0))
+FAKE_MODEL_TRUNCATION_RATE = float(os.getenv('FAKE_MODEL_TRUNCATION_RATE', 0))
+FAKE_MODEL_INVALID_RATE = float(os.getenv('FAKE_MODEL_INVALID_RATE', 0))
+# Makes the fake backend sleep on the event loop the way a synchronous SDK call would
+FAKE_MODEL_BLOCKING = os.getenv('FAKE_MODEL_BLOCKING', 'false').lower() in ('1', 'true', 'yes')
+
+# Where Regular mode fields come from: 'model' (the model writes every field), 'hybrid' (the model
+# writes names and occupations, contact details are generated locally) or 'local' (no model calls)
+REGULAR_GENERATOR = os.getenv('REGULAR_GENERATOR', 'model')
+LOCAL_GENERATOR_LOCALE = os.getenv('LOCAL_GENERATOR_LOCALE', 'en_US')
+LOCAL_GENERATOR_SEED = int(os.getenv('LOCAL_GENERATOR_SEED', 0))
+
+# Upper bound on model calls in flight at once across all sessions; the actual limit
+# halves when rate limits or server errors come back and grows again on success
+MAX_CONCURRENT_GENERATIONS = int(os.getenv('MAX_CONCURRENT_GENERATIONS', 8))
+
+# Client-side quotas for model calls (0 disables a limit), and retries with jittered
+# exponential backoff for rate limits and transient server errors
+MODEL_RPM = int(os.getenv('MODEL_RPM', 1000))
+MODEL_TPM = int(os.getenv('MODEL_TPM', 1_000_000))
+MODEL_MAX_RETRIES = int(os.getenv('MODEL_MAX_RETRIES', 3))
+MODEL_RETRY_BASE_DELAY = float(os.getenv('MODEL_RETRY_BASE_DELAY', 1.0))
+MODEL_RETRY_MAX_DELAY = float(os.getenv('MODEL_RETRY_MAX_DELAY', 30))
+
+# Response cache: in-memory LRU, plus a SQLite tier when CACHE_DB_PATH is set
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 256))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 3600))
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH')
+
+# Warm pool of pre-generated people; set WARM_POOL_DEPTH=0 to disable
+WARM_POOL_DEPTH = int(os.getenv('WARM_POOL_DEPTH', 10))
+WARM_POOL_LOW_WATER = int(os.getenv('WARM_POOL_LOW_WATER', 3))
+WARM_POOL_REFILL_CONCURRENCY = int(os.getenv('WARM_POOL_REFILL_CONCURRENCY', 2))
+WARM_POOL_MAX_AGE_SECONDS = float(os.getenv('WARM_POOL_MAX_AGE_SECONDS', 1800))
+WARM_POOL_FANTASY = os.getenv('WARM_POOL_FANTASY', 'false').lower() in ('1', 'true', 'yes')
+
+# Story Mode: 'outline' writes an outline then all chapters concurrently, 'single' uses one call
+STORY_PIPELINE = os.getenv('STORY_PIPELINE', 'outline')
+STORY_CHAPTERS = int(os.getenv('STORY_CHAPTERS', 4))
+
+# Rows per INSERT statement in SQL exports
+SQL_INSERT_CHUNK_ROWS = int(os.getenv('SQL_INSERT_CHUNK_ROWS', 500))
+
+# Large requests are split into shards of this size and generated concurrently
+SHARD_SIZE = int(os.getenv('SHARD_SIZE', 10))
+MAX_BATCH_ENTRIES = int(os.getenv('MAX_BATCH_ENTRIES', 5000))
+# The result dialog draws at most this many people; the rest of a batch is kept for export
+DIALOG_PREVIEW_ENTRIES = int(os.getenv('DIALOG_PREVIEW_ENTRIES', 100))
+# Streams hand the event loop back after this many people, so a fast source can't starve other sessions
+STREAM_YIELD_EVERY = int(os.getenv('STREAM_YIELD_EVERY', 20))
+MAX_BATCH_ROUNDS = 3
+# Top-up requests list at most this many already generated people for the model to avoid
+TOPUP_EXCLUDE_LIMIT = int(os.getenv('TOPUP_EXCLUDE_LIMIT', 50))
+
+# HTTP API requests streamed at once; further requests get 429 until one finishes
+API_MAX_CONCURRENT_REQUESTS = int(os.getenv('API_MAX_CONCURRENT_REQUESTS', 4))
+
+# Latency quantiles on /metrics are computed over this many recent observations per mode
+METRICS_LATENCY_WINDOW = int(os.getenv('METRICS_LATENCY_WINDOW', 1024))
+
+# Event-loop watchdog: lag is sampled every LOOP_WATCHDOG_INTERVAL seconds, and a stall longer than
+# LOOP_STALL_SECONDS logs the blocking stack and is counted per call site (0 disables the watchdog)
+LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', 0.1))
+LOOP_STALL_SECONDS = float(os.getenv('LOOP_STALL_SECONDS', 0.25))
+
+
+# Per-browser session state; sessions with no open page are dropped once idle for SESSION_IDLE_SECONDS
+SESSION_IDLE_SECONDS = float(os.getenv('SESSION_IDLE_SECONDS', 1800))
+STORAGE_SECRET = os.getenv('STORAGE_SECRET') or secrets.token_hex(16)
+
+# Cards shown per page in the Favorites and History tabs
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', 20))
+
+# SQLite file holding every session's history and favorites
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', 'fake_frenzy.db')
+
+# JSON file of extra record schemas; each one becomes a generation mode of its own
+RECORD_SCHEMAS_PATH = os.getenv('RECORD_SCHEMAS_PATH')
+
+# Seeded generations are kept here as content-addressed NDJSON files
+DATASET_DIR = os.getenv('DATASET_DIR', 'datasets')
+# Part of every dataset key; bump it whenever prompts, response schemas or local generator tables change
+PROMPT_VERSION = 2
+
+
+FANTASY_SUBTYPES = {
+    'Time Travel': [
+        'Ancient (3000 BC - 500 AD)',
+        'Medieval (500 - 1500)',
+        'Renaissance (1300 - 1700)',
+        'Victorian (1837 - 1901)',
+        'Modern (1901 - Present)',
+        'Future (2100+)'
+    ],
+    'Character Universe': [
+        'Royal Family',
+        'Magical Academy',
+        'Adventurer Guild',
+        'Mythical Creatures',
+        'Ancient Gods'
+    ],
+    'Alternate Reality': [
+        'Steampunk',
+        'Cyberpunk',
+        'Post-Apocalyptic',
+        'Utopian',
+        'Magical Realism'
+    ]
+}
 
 
 paper_style = '''
-<style>
 body { 
     background-color: #f7f1e3 !important; 
     background-image: url("data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAADIAAAAyCAMAAAAp4XiDAAAAUVBMVEWFhYWDg4N3d3dtbW17e3t1dXWBgYGHh4d5eXlzc3OLi4ubm5uVlZWPj4+NjY19fX2JiYl/f39ra2uRkZGZmZlpaWmXl5dvb29xcXGTk5NnZ2c8TV1mAAAAG3RSTlNAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEAvEOwtAAAFVklEQVR4XpWWB67c2BUFb3g557T/hRo9/WUMZHlgr4Bg8Z4qQgQJlHI4A8SzFVrapvmTF9O7dmYRFZ60YiBhJRCgh1FYhiLAmdvX0CzTOpNE77ME0Zty/nWWzchDtiqrmQDeuv3powQ5ta2eN0FY0InkqDD73lT9c9lEzwUNqgFHs9VQce3TVClFCQrSTfOiYkVJQBmpbq2L6iZavPnAPcoU0dSw0SUTqz/GtrGuXfbyyBniKykOWQWGqwwMA7QiYAxi+IlPdqo+hYHnUt5ZPfnsHJyNiDtnpJyayNBkF6cWoYGAMY92U2hXHF/C1M8uP/ZtYdiuj26UdAdQQSXQErwSOMzt/XWRWAz5GuSBIkwG1H3FabJ2OsUOUhGC6tK4EMtJO0ttC6IBD3kM0ve0tJwMdSfjZo+EEISaeTr9P3wYrGjXqyC1krcKdhMpxEnt5JetoulscpyzhXN5FRpuPHvbeQaKxFAEB6EN+cYN6xD7RYGpXpNndMmZgM5Dcs3YSNFDHUo2LGfZuukSWyUYirJAdYbF3MfqEKmjM+I2EfhA94iG3L7uKrR+GdWD73ydlIB+6hgref1QTlmgmbM3/LeX5GI1Ux1RWpgxpLuZ2+I+IjzZ8wqE4nilvQdkUdfhzI5QDWy+kw5Wgg2pGpeEVeCCA7b85BO3F9DzxB3cdqvBzWcmzbyMiqhzuYqtHRVG2y4x+KOlnyqla8AoWWpuBoYRxzXrfKuILl6SfiWCbjxoZJUaCBj1CjH7GIaDbc9kqBY3W/Rgjda1iqQcOJu2WW+76pZC9QG7M00dffe9hNnseupFL53r8F7YHSwJWUKP2q+k7RdsxyOB11n0xtOvnW4irMMFNV4H0uqwS5ExsmP9AxbDTc9JwgneAT5vTiUSm1E7BSflSt3bfa1tv8Di3R8n3Af7MNWzs49hmauE2wP+ttrq+AsWpFG2awvsuOqbipWHgtuvuaAE+A1Z/7gC9hesnr+7wqCwG8c5yAg3AL1fm8T9AZtp/bbJGwl1pNrE7RuOX7PeMRUERVaPpEs+yqeoSmuOlokqw49pgomjLeh7icHNlG19yjs6XXOMedYm5xH2YxpV2tc0Ro2jJfxC50ApuxGob7lMsxfTbeUv07TyYxpeLucEH1gNd4IKH2LAg5TdVhlCafZvpskfncCfx8pOhJzd76bJWeYFnFciwcYfubRc12Ip/ppIhA1/mSZ/RxjFDrJC5xifFjJpY2Xl5zXdguFqYyTR1zSp1Y9p+tktDYYSNflcxI0iyO4TPBdlRcpeqjK/piF5bklq77VSEaA+z8qmJTFzIWiitbnzR794USKBUaT0NTEsVjZqLaFVqJoPN9ODG70IPbfBHKK+/q/AWR0tJzYHRULOa4MP+W/HfGadZUbfw177G7j/OGbIs8TahLyynl4X4RinF793Oz+BU0saXtUHrVBFT/DnA3ctNPoGbs4hRIjTok8i+algT1lTHi4SxFvONKNrgQFAq2/gFnWMXgwffgYMJpiKYkmW3tTg3ZQ9Jq+f8XN+A5eeUKHWvJWJ2sgJ1Sop+wwhqFVijqWaJhwtD8MNlSBeWNNWTa5Z5kPZw5+LbVT99wqTdx29lMUH4OIG/D86ruKEauBjvH5xy6um/Sfj7ei6UUVk4AIl3MyD4MSSTOFgSwsH/QJWaQ5as7ZcmgBZkzjjU1UrQ74ci1gWBCSGHtuV1H2mhSnO3Wp/3fEV5a+4wz//6qy8JxjZsmxxy5+4w9CDNJY09T072iKG0EnOS0arEYgXqYnXcYHwjTtUNAcMelOd4xpkoqiTYICWFq0JSiPfPDQdnt+4/wuqcXY47QILbgAAAABJRU5ErkJggg==");
@@ -280,87 +397,166 @@ body.q-dialog--modal {
     font-family: 'Comic Sans MS', cursive, sans-serif;
     font-size: 1.2em !important;
 }
-</style>
 '''
 
 
-def show_data_dialog(data, mode='Regular'):
+DIALOG_TITLES = {
+    'Regular': '🎲 Generated Data',
+    'Fantasy Mode': '✨ Fantasy Data',
+    'Story Mode': '📖 Story Mode',
+    'Surprise': '🎲 Surprise Data Generated!'
+}
+
+
+# Record schema behind each UI mode; custom schemas appear in the UI under their own name
+UI_MODE_SCHEMAS = {'Regular': 'regular', 'Fantasy Mode': 'fantasy', 'Story Mode': 'regular', 'Surprise': 'surprise'}
+
+
+def render_person(person, index, mode='Regular'):
+    if index > 0:
+        ui.separator().classes('my-4')
+
+    schema = RECORD_SCHEMAS.get(UI_MODE_SCHEMAS.get(mode, mode), RECORD_SCHEMAS['regular'])
+    if mode == 'Fantasy Mode':
+        heading = person.get('title', 'Character')
+    else:
+        heading = 'Person' if mode in UI_MODE_SCHEMAS else 'Record'
+    ui.label(f"{heading} {index+1}:").classes('text-h6 mt-4')
+    for name, spec in schema.fields.items():
+        value = person.get(name)
+        if isinstance(spec, list):
+            if value:
+                ui.label(f'{schema.label(name)}:').classes('mt-2 font-bold')
+                for item in value:
+                    ui.label(f"• {schema.format_item(name, item)}").classes('ml-4')
+        elif isinstance(spec, dict) or spec == 'text':
+            ui.label(f'{schema.label(name)}:').classes('mt-2 font-bold')
+            ui.label(schema.format_item(name, value)).classes('ml-4')
+        else:
+            ui.label(f"{schema.label(name)}: {value}").classes('mt-2')
+
+
+def render_chapter(chapter):
+    ui.label(chapter.get('heading', 'Chapter')).classes('text-h6 mt-4')
+    ui.label(chapter.get('content', '')).classes('mt-2')
+    ui.separator().classes('my-4')
+
+
+def render_epilogue(epilogue):
+    ui.label('Epilogue').classes('text-h6 mt-4')
+    ui.label(epilogue).classes('mt-2')
+
+
+def hidden_entries_text(total):
+    return f'...and {total - DIALOG_PREVIEW_ENTRIES} more. Use Export, or the command line for larger batches.'
+
+
+def show_data_dialog(session, data, mode='Regular'):
+    # Returns the dialog and its content column so streaming callers can append to it
     with ui.dialog() as dialog, ui.card().classes('w-96 dialog-content'):
         
         with ui.row().classes('w-full justify-between items-center mb-4'):
-            title = '🎲 Generated Data' if mode == 'Regular' else '✨ Fantasy Data' if mode == 'Fantasy Mode' else '📖 Story Mode'
-            ui.label(title).classes('text-h6')
-            ui.button(icon='favorite', on_click=lambda: save_to_favorites(data)).classes(
+            ui.label(DIALOG_TITLES.get(mode, DIALOG_TITLES['Regular'])).classes('text-h6')
+            ui.button(icon='favorite', on_click=lambda: save_to_favorites(session, data, mode)).classes(
                 'text-red-500 bg-transparent hover:bg-red-50'
             ).tooltip('Add to Favorites')
 
-        with ui.column().classes('max-h-96 overflow-auto'):
-            if mode == 'Regular':
-                for i, person in enumerate(data.get('people', [])):
-                    ui.label(f"Person {i+1}:").classes('text-h6 mt-4')
-                    ui.label(f"Name: {person.get('full_name')}").classes('mt-2')
-                    ui.label(f"Email: {person.get('email')}").classes('mt-2')
-                    ui.label(f"Address: {person.get('address')}").classes('mt-2')
-                    ui.label(f"Phone: {person.get('phone_number')}").classes('mt-2')
-                    ui.label(f"Occupation: {person.get('occupation')}").classes('mt-2')
-                    if i < len(data.get('people')) - 1:
-                        ui.separator().classes('my-4')
-            
-            elif mode == 'Fantasy Mode':
-                for i, person in enumerate(data.get('people', [])):
-                    ui.label(f"{person.get('title', 'Character')} {i+1}:").classes('text-h6 mt-4')
-                    ui.label(f"Name: {person.get('full_name')}").classes('mt-2')
-                    ui.label(f"Title: {person.get('title')}").classes('mt-2')
-                    ui.label(f"Age: {person.get('age')}").classes('mt-2')
-                    ui.label(f"Origin: {person.get('origin')}").classes('mt-2')
-                    ui.label(f"Occupation: {person.get('occupation')}").classes('mt-2')
-                    
-                    if person.get('special_traits'):
-                        ui.label('Special Traits:').classes('mt-2 font-bold')
-                        for trait in person['special_traits']:
-                            ui.label(f"• {trait}").classes('ml-4')
-                    
-                    if person.get('equipment'):
-                        ui.label('Equipment:').classes('mt-2 font-bold')
-                        for item in person['equipment']:
-                            ui.label(f"• {item}").classes('ml-4')
-                    
-                    if person.get('relationships'):
-                        ui.label('Relationships:').classes('mt-2 font-bold')
-                        for rel in person['relationships']:
-                            ui.label(f"• {rel['type']} to {rel['to']}").classes('ml-4')
-                    
-                    ui.label('Backstory:').classes('mt-2 font-bold')
-                    ui.label(person.get('backstory')).classes('ml-4')
-                    
-                    if i < len(data.get('people')) - 1:
-                        ui.separator().classes('my-4')
-            
-            elif mode == 'Story Mode':
+        with ui.column().classes('max-h-96 overflow-auto') as content:
+            if mode == 'Story Mode':
                 if 'story' in data:
                     story = data['story']
                     ui.label(story.get('title', 'Story')).classes('text-h5 mb-4')
                     for chapter in story.get('chapters', []):
-                        ui.label(chapter.get('heading', 'Chapter')).classes('text-h6 mt-4')
-                        ui.label(chapter.get('content', '')).classes('mt-2')
-                        ui.separator().classes('my-4')
+                        render_chapter(chapter)
                     if story.get('epilogue'):
-                        ui.label('Epilogue').classes('text-h6 mt-4')
-                        ui.label(story['epilogue']).classes('mt-2')
+                        render_epilogue(story['epilogue'])
+            else:
+                people = data.get('people', [])
+                for i, person in enumerate(people[:DIALOG_PREVIEW_ENTRIES]):
+                    render_person(person, i, mode)
+                if len(people) > DIALOG_PREVIEW_ENTRIES:
+                    ui.label(hidden_entries_text(len(people))).classes('mt-4 text-gray-500')
 
        
+        async def save_and_close():
+            dialog.close()
+            await save_to_favorites(session, data, mode)
+
         with ui.row().classes('w-full justify-between mt-4'):
             ui.button('Close', on_click=dialog.close)
-            ui.button(
-                'Add to Favorites', 
-                on_click=lambda: [save_to_favorites(data), dialog.close()]
-            ).classes('bg-red-600')
+            ui.button('Add to Favorites', on_click=save_and_close).classes('bg-red-600')
         dialog.open()
-
-
-def main_page():
-    global mode, fantasy_type_select, era, universe_type, reality_type
-    ui.html(paper_style)
+    return dialog, content
+
+
+async def stream_into_dialog(session, people, mode='Regular'):
+    # Opens the dialog straight away and renders each person as the stream delivers it.
+    # Only the first DIALOG_PREVIEW_ENTRIES are drawn; the rest are counted below them.
+    data = {"people": []}
+    dialog, content = show_data_dialog(session, data, mode=mode)
+    more_label = None
+    async for person in people:
+        index = len(data['people'])
+        if index < DIALOG_PREVIEW_ENTRIES:
+            with content:
+                render_person(person, index, mode)
+        elif more_label is None:
+            with content:
+                more_label = ui.label().classes('mt-4 text-gray-500')
+        data['people'].append(person)
+        if len(data['people']) % STREAM_YIELD_EVERY == 0:
+            if more_label:
+                more_label.set_text(hidden_entries_text(len(data['people'])))
+            await asyncio.sleep(0)
+    if more_label:
+        more_label.set_text(hidden_entries_text(len(data['people'])))
+    if not data['people']:
+        dialog.close()
+        return None
+    return data
+
+
+async def stream_story_into_dialog(session, data, events):
+    # Shows the title and each chapter as soon as the story stream completes them
+    dialog, content = show_data_dialog(session, data, mode='Story Mode')
+    story = {"title": '', "chapters": [], "epilogue": ''}
+    data['story'] = story
+    with content:
+        title_label = ui.label('Writing story...').classes('text-h5 mb-4')
+        chapters_column = ui.column().classes('w-full gap-0')
+        epilogue_column = ui.column().classes('w-full gap-0')
+
+    # Chapters may finish out of order, so each one renders into its own slot
+    chapters = {}
+    slots = {}
+    async for kind, index, value in events:
+        if kind == 'title':
+            story['title'] = value
+            title_label.set_text(value)
+        elif kind == 'outline':
+            for i, heading in enumerate(value):
+                with chapters_column:
+                    with ui.column().classes('w-full gap-0') as slots[i]:
+                        ui.label(f'Writing {heading}...').classes('text-gray-500 mt-4')
+        elif kind == 'chapter':
+            chapters[index] = value
+            if index not in slots:
+                with chapters_column:
+                    slots[index] = ui.column().classes('w-full gap-0')
+            slots[index].clear()
+            with slots[index]:
+                render_chapter(value)
+        elif kind == 'epilogue':
+            story['epilogue'] = value
+            with epilogue_column:
+                render_epilogue(value)
+    story['chapters'] = [chapters[i] for i in sorted(chapters)]
+    return data
+
+
+async def main_page():
+    session = sessions.current()
+    ui.add_css(paper_style)
     
     with ui.column().classes('w-full items-center gap-2'):
         ui.label('Fake Frenzy').classes('text-h3 text-center font-bold')
@@ -382,7 +578,8 @@ def main_page():
                     options=[
                         'Regular',
                         'Fantasy Mode',
-                        'Story Mode'
+                        'Story Mode',
+                        *CUSTOM_SCHEMAS
                     ],
                     value='Regular',
                     label='Generation Mode'
@@ -394,11 +591,7 @@ def main_page():
 
                 with fantasy_container:
                     fantasy_type_select = ui.select(
-                        options=[
-                            'Time Travel',
-                            'Character Universe',
-                            'Alternate Reality'
-                        ],
+                        options=list(FANTASY_SUBTYPES),
                         value='Time Travel',
                         label='Fantasy Type'
                     ).classes('w-48 mb-2')
@@ -409,14 +602,7 @@ def main_page():
                     
                     with time_travel_container:
                         era = ui.select(
-                            options=[
-                                'Ancient (3000 BC - 500 AD)',
-                                'Medieval (500 - 1500)',
-                                'Renaissance (1300 - 1700)',
-                                'Victorian (1837 - 1901)',
-                                'Modern (1901 - Present)',
-                                'Future (2100+)'
-                            ],
+                            options=FANTASY_SUBTYPES['Time Travel'],
                             value='Medieval (500 - 1500)',
                             label='Time Period'
                         ).classes('w-48')
@@ -427,13 +613,7 @@ def main_page():
                     
                     with universe_container:
                         universe_type = ui.select(
-                            options=[
-                                'Royal Family',
-                                'Magical Academy',
-                                'Adventurer Guild',
-                                'Mythical Creatures',
-                                'Ancient Gods'
-                            ],
+                            options=FANTASY_SUBTYPES['Character Universe'],
                             value='Magical Academy',
                             label='Universe Type'
                         ).classes('w-48')
@@ -444,533 +624,2772 @@ def main_page():
                     
                     with reality_container:
                         reality_type = ui.select(
-                            options=[
-                                'Steampunk',
-                                'Cyberpunk',
-                                'Post-Apocalyptic',
-                                'Utopian',
-                                'Magical Realism'
-                            ],
+                            options=FANTASY_SUBTYPES['Alternate Reality'],
                             value='Steampunk',
                             label='Reality Type'
                         ).classes('w-48')
 
                 def update_num_entries(event):
-                    global num_entries
                     try:
                         value = event.value
                         if value is None:
-                            num_entries = 1
+                            session.num_entries = 1
                         else:
-                            num_entries = max(1, int(value))
+                            session.num_entries = min(max(1, int(value)), MAX_BATCH_ENTRIES)
                     except (ValueError, TypeError):
-                        num_entries = 1
+                        session.num_entries = 1
                         ui.notify('Invalid number, using default value of 1', type='warning')
 
                 ui.number(
                     'Number of Entries',
-                    value=1,
+                    value=session.num_entries,
                     min=1,
-                    max=10,  
+                    max=MAX_BATCH_ENTRIES,
                     format='%d',  
                     on_change=update_num_entries
                 ).classes('w-40')
 
+                subtype_selects = {
+                    'Time Travel': era,
+                    'Character Universe': universe_type,
+                    'Alternate Reality': reality_type
+                }
+
                 with ui.row().classes('gap-4'):
-                    ui.button('Generate Data', on_click=lambda: generate_data()).classes('px-4')
-                    ui.button('🎲 Surprise Me!', on_click=lambda: generate_surprise()).classes('px-4 bg-purple-600')
-                    ui.button('Export', on_click=lambda: export_data(export_format)).classes('px-4')
+                    ui.button('Generate Data', on_click=lambda: generate_data(
+                        session, mode.value, fantasy_type_select.value, subtype_selects[fantasy_type_select.value].value
+                    )).classes('px-4')
+                    ui.button('🎲 Surprise Me!', on_click=lambda: generate_surprise(session)).classes('px-4 bg-purple-600')
+                    ui.button('Export', on_click=lambda: export_data(
+                        session.last_result, session.export_format, compress=session.compress_exports
+                    )).classes('px-4')
+
+        async def export_favorites():
+            people = await entry_store.all_data(session.session_id, 'favorite')
+            await export_data({"people": people}, session.export_format, name='favorites', compress=session.compress_exports)
 
         with ui.tab_panel('Favorites'):
-            global favorites_container
-            favorites_container = ui.column().classes('w-full')
-            refresh_containers()
+            with ui.row().classes('w-full justify-between items-center px-4'):
+                favorites_search = ui.input('Search names, occupations, backstories').props('debounce=300').classes('w-72')
+                ui.button('Export Favorites', on_click=export_favorites)
+            with ui.scroll_area().classes('w-full h-96'):
+                with ui.column().classes('w-full gap-4 p-4'):
+                    favorites_list = PagedList(
+                        lambda offset, limit: entry_store.page(
+                            session.session_id, 'favorite', offset, limit, newest_first=False,
+                            query=favorites_search.value
+                        ),
+                        lambda row: render_favorite(session, row),
+                        'No favorites yet'
+                    )
+            favorites_search.on_value_change(favorites_list.reset)
 
         with ui.tab_panel('History'):
-            global history_container
-            history_container = ui.column().classes('w-full')
-            refresh_containers()
+            with ui.row().classes('w-full justify-between items-center px-4'):
+                history_search = ui.input('Search names, occupations, backstories').props('debounce=300').classes('w-72')
+                history_mode = ui.select(
+                    ['All', 'Regular', 'Fantasy Mode', 'Story Mode', 'Surprise', *CUSTOM_SCHEMAS], value='All', label='Mode'
+                ).classes('w-40')
+                ui.button('Clear History', on_click=lambda: clear_history(session))
+            with ui.scroll_area().classes('w-full h-96'):
+                with ui.column().classes('w-full gap-4 p-4'):
+                    history_list = PagedList(
+                        lambda offset, limit: entry_store.page(
+                            session.session_id, 'history', offset, limit,
+                            mode=None if history_mode.value == 'All' else history_mode.value,
+                            query=history_search.value
+                        ),
+                        lambda row: render_history_entry(session, row),
+                        'No history yet'
+                    )
+            history_search.on_value_change(history_list.reset)
+            history_mode.on_value_change(history_list.reset)
+
+        sessions.attach(session, favorites_list, history_list)
+        await favorites_list.sync()
+        await history_list.sync()
 
         with ui.tab_panel('Settings'):
             with ui.column().classes('w-full gap-4 p-4'):
                 def update_export_format(e):
-                    global export_format
-                    export_format = e.value
+                    session.export_format = e.value
                     ui.notify(f'Default export format set to {e.value.upper()}')
 
                 ui.select(
-                    ['json', 'csv', 'sql'],
-                    value=export_format,
+                    ['json', 'jsonl', 'csv', 'sql'],
+                    value=session.export_format,
                     label='Default Export Format',
                     on_change=update_export_format
                 ).classes('w-48')
                 
-                def update_max_history(e):
-                    global max_history_entries
-                    max_history_entries = int(e.value)
-                    ui.notify(f'Max history entries set to {max_history_entries}')
+                def update_compress_exports(e):
+                    session.compress_exports = e.value
+                    ui.notify('Exports will be gzip-compressed' if e.value else 'Exports will be uncompressed')
+
+                ui.switch('Compress Exports (gzip)', value=session.compress_exports, on_change=update_compress_exports)
+                
+                def update_fresh_results(e):
+                    session.fresh_results = e.value
+                    ui.notify('Always generating fresh results' if e.value else 'Reusing cached results')
+
+                ui.switch('Always Generate Fresh Results', value=session.fresh_results, on_change=update_fresh_results)
+
+                def update_seed(e):
+                    session.seed = None if e.value is None else int(e.value)
+                    ui.notify('Random results' if session.seed is None else f'Reproducible results with seed {session.seed}')
+
+                ui.number('Seed (blank for random results)', value=session.seed, format='%d', on_change=update_seed).classes('w-64')
+
+                cache_label = ui.label().classes('text-gray-500')
+                usage_label = ui.label().classes('text-gray-500')
+                session_label = ui.label().classes('text-gray-500')
+
+                def update_cache_label():
+                    stats = response_cache.stats
+                    cache_label.set_text(
+                        f"Cache: {len(response_cache.entries)}/{response_cache.max_entries} entries, "
+                        f"{stats['hits']} hits ({stats['disk_hits']} from disk), {stats['misses']} misses, "
+                        f"{stats['evictions']} evictions, {stats['expirations']} expired"
+                    )
+                    usage_label.set_text(f"Tokens: {token_usage.summary()}")
+                    session_label.set_text(f"{len(sessions.sessions)} active sessions")
+
+                update_cache_label()
+                ui.timer(5.0, update_cache_label)
+
+
+class ModelResponse:
+    def __init__(self, text, cached=False):
+        self.text = text
+        self.cached = cached
+
+
+STRING_SCHEMA = {'type': 'string'}
+
+
+def object_schema(**properties):
+    return {'type': 'object', 'properties': properties, 'required': list(properties)}
+
+
+def list_schema(items, count=None):
+    schema = {'type': 'array', 'items': items}
+    if count:
+        schema.update(min_items=count, max_items=count)
+    return schema
+
+
+CHAPTER_SCHEMA = object_schema(heading=STRING_SCHEMA, content=STRING_SCHEMA)
+SCALAR_TYPES = {'string': 'string', 'text': 'string', 'integer': 'integer', 'number': 'number', 'boolean': 'boolean'}
+
+
+def coerce_string(value):
+    if type(value) is str and value.strip():
+        return value.strip()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError('expected a non-empty string')
+
+
+def coerce_number(value, cast=float):
+    # Also accepts numbers written as text, e.g. "32" or "about 32 years"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return cast(value)
+    match = re.search(r'-?\d+(\.\d+)?', value) if isinstance(value, str) else None
+    if not match:
+        raise ValueError('expected a number')
+    return cast(float(match.group()))
+
+
+def coerce_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'yes', 'false', 'no'):
+        return value.strip().lower() in ('true', 'yes')
+    raise ValueError('expected true or false')
+
+
+SCALAR_COERCERS = {
+    'string': coerce_string, 'text': coerce_string, 'integer': lambda value: coerce_number(value, int),
+    'number': coerce_number, 'boolean': coerce_boolean
+}
 
-                ui.number(
-                    'Max History Entries',
-                    value=max_history_entries,
-                    min=1,
-                    max=100,
-                    on_change=update_max_history
-                ).classes('w-48')
 
+def list_coercer(coerce_item, split_text=False):
+    # A bare value becomes a one-item list (or is split on commas for string lists);
+    # items that don't fit are dropped, and only an empty result rejects the field
+    def coerce(value):
+        if not isinstance(value, list):
+            value = value.split(',') if split_text and isinstance(value, str) else [value]
+        try:
+            items = [coerce_item(item) for item in value]
+        except ValueError:
+            items = []
+            for item in value:
+                try:
+                    items.append(coerce_item(item))
+                except ValueError:
+                    pass
+        if not items:
+            raise ValueError('expected a non-empty list')
+        return items
+    return coerce
+
+
+def object_coercer(checks):
+    # Unknown keys are dropped and fields come back in schema order
+    def coerce(value):
+        if not isinstance(value, dict):
+            raise ValueError('expected an object')
+        record = {}
+        for name, check in checks:
+            if value.get(name) is None:
+                raise ValueError(f'missing {name}')
+            try:
+                record[name] = check(value[name])
+            except ValueError as e:
+                raise ValueError(f'{name}: {e}') from None
+        return record
+    return coerce
+
+
+def compile_field(spec):
+    # (response schema, prompt notation, coercer) for a field type: a scalar type name,
+    # a one-item list for list fields or a dict of fields for a nested object
+    if isinstance(spec, list) and len(spec) == 1:
+        schema, notation, coerce = compile_field(spec[0])
+        return list_schema(schema), f'[{notation}]', list_coercer(coerce, split_text=spec[0] == 'string')
+    if isinstance(spec, dict) and spec:
+        compiled = {name: compile_field(field) for name, field in spec.items()}
+        notation = ', '.join(name if field == 'string' else f'{name}: {compiled[name][1]}' for name, field in spec.items())
+        return (
+            object_schema(**{name: schema for name, (schema, _, _) in compiled.items()}),
+            f'{{{notation}}}',
+            object_coercer([(name, coerce) for name, (_, _, coerce) in compiled.items()])
+        )
+    if isinstance(spec, str) and spec in SCALAR_TYPES:
+        return {'type': SCALAR_TYPES[spec]}, spec, SCALAR_COERCERS[spec]
+    raise ValueError(f'Invalid field type {spec!r}; expected one of {", ".join(SCALAR_TYPES)}, [type] or {{fields}}')
+
+
+class RecordSchema:
+    # A record shape declared once as {field: type} and compiled up front into Gemini's
+    # response schema, a compact prompt fragment and a validator that repairs near misses
+    # (numbers as text, a bare value for a list) and rejects records it cannot repair.
+    def __init__(self, name, fields, description='fictional people', labels=None, formats=None):
+        self.name = name
+        self.fields = fields
+        self.description = description
+        self.labels = labels or {}
+        self.formats = formats or {}
+        self.item_schema, notation, self.coerce = compile_field(fields)
+        self.prompt_fragment = f'Each record: {notation}.'
+
+    def validate_batch(self, records):
+        # One pass; returns the normalized valid records and (record, reason) for the rest
+        valid, rejected = [], []
+        for record in records:
+            try:
+                valid.append(self.coerce(record))
+            except ValueError as e:
+                rejected.append((record, str(e)))
+        return valid, rejected
+
+    def label(self, name):
+        return self.labels.get(name, name.replace('_', ' ').title())
+
+    def format_item(self, name, item):
+        if isinstance(item, dict):
+            if name in self.formats:
+                return self.formats[name].format_map(item)
+            return ', '.join(f'{self.label(key)}: {value}' for key, value in item.items())
+        return str(item)
+
+
+PERSON_FIELDS = {'full_name': 'string', 'email': 'string', 'address': 'string', 'phone_number': 'string', 'occupation': 'string'}
+PERSON_LABELS = {'full_name': 'Name', 'phone_number': 'Phone'}
+RECORD_SCHEMAS = {
+    'regular': RecordSchema('regular', PERSON_FIELDS, labels=PERSON_LABELS),
+    'surprise': RecordSchema('surprise', PERSON_FIELDS, labels=PERSON_LABELS),
+    'regular_names': RecordSchema('regular_names', {'full_name': 'string', 'occupation': 'string'}, labels=PERSON_LABELS),
+    'fantasy': RecordSchema('fantasy', {
+        'full_name': 'string', 'title': 'string', 'age': 'string', 'origin': 'string', 'occupation': 'string',
+        'special_traits': ['string'], 'equipment': ['string'], 'relationships': [{'type': 'string', 'to': 'string'}],
+        'backstory': 'text'
+    }, description='fantasy characters', labels=PERSON_LABELS, formats={'relationships': '{type} to {to}'})
+}
+BUILT_IN_MODES = set(RECORD_SCHEMAS) | {'story', 'story_outline', 'story_chapter', 'story_epilogue'}
+
+
+def load_record_schemas(path):
+    # {"pets": {"description": "fictional pets", "fields": {"name": "string", "age": "integer",
+    #  "toys": ["string"], "owner": {"full_name": "string", "email": "string"}}}}
+    with open(path) as f:
+        definitions = json.load(f)
+    schemas = {}
+    for name, definition in definitions.items():
+        if name in BUILT_IN_MODES or not re.fullmatch(r'[a-z][a-z0-9_]*', name):
+            raise ValueError(f'{path}: schema name {name!r} must be lowercase and not a built-in mode')
+        if not isinstance(definition.get('fields'), dict):
+            raise ValueError(f'{path}: schema {name!r} needs a "fields" object')
+        schemas[name] = RecordSchema(
+            name, definition['fields'], description=definition.get('description', f'fictional {name}'),
+            labels=definition.get('labels'), formats=definition.get('formats')
+        )
+    return schemas
+
+
+CUSTOM_SCHEMAS = load_record_schemas(RECORD_SCHEMAS_PATH) if RECORD_SCHEMAS_PATH else {}
+RECORD_SCHEMAS.update(CUSTOM_SCHEMAS)
+
+
+def response_schema(mode, count=1):
+    # JSON schema for the model's structured output mode; count pins the list length where it is known
+    if mode == 'story':
+        return object_schema(title=STRING_SCHEMA, chapters=list_schema(CHAPTER_SCHEMA), epilogue=STRING_SCHEMA)
+    if mode == 'story_outline':
+        return object_schema(title=STRING_SCHEMA, chapters=list_schema(object_schema(heading=STRING_SCHEMA, beat=STRING_SCHEMA), count))
+    if mode == 'story_chapter':
+        return CHAPTER_SCHEMA
+    if mode == 'story_epilogue':
+        return object_schema(epilogue=STRING_SCHEMA)
+    return object_schema(people=list_schema(RECORD_SCHEMAS[mode].item_schema, count))
+
+
+def validate_records(mode, records):
+    # Repaired records are kept; the rest are logged, counted and dropped, so callers
+    # re-request only as many records as were rejected
+    valid, rejected = RECORD_SCHEMAS[mode].validate_batch(records)
+    if rejected:
+        metrics.inc('invalid_records_total', len(rejected), mode=mode)
+        logger.warning('Dropped %d invalid %s records (first: %s)', len(rejected), mode, rejected[0][1])
+    return valid
+
+
+class TokenUsage:
+    # Prompt and output tokens per mode as reported by the model's usage metadata.
+    # Cached responses make no call, so they add nothing here.
+    def __init__(self):
+        self.modes = {}
+
+    def record(self, mode, prompt_tokens, output_tokens):
+        stats = self.modes.setdefault(mode, {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0})
+        stats['calls'] += 1
+        stats['prompt_tokens'] += prompt_tokens
+        stats['output_tokens'] += output_tokens
+
+    def summary(self):
+        return ', '.join(
+            f"{mode} {stats['prompt_tokens'] / stats['calls']:,.0f} in / {stats['output_tokens'] / stats['calls']:,.0f} out "
+            f"per call ({stats['calls']} calls)"
+            for mode, stats in sorted(self.modes.items())
+        ) or 'no model calls yet'
+
+
+token_usage = TokenUsage()
+
+
+class Metrics:
+    # Counters, gauges and per-mode latency summaries, rendered in the Prometheus text format.
+    # Quantiles are computed over the most recent observations in a sliding window.
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=METRICS_LATENCY_WINDOW, prefix='fakefrenzy'):
+        self.window = window
+        self.prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.help = {}
+
+    @staticmethod
+    def series(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, amount=1, **labels):
+        key = self.series(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add(self, name, amount, **labels):
+        key = self.series(name, labels)
+        self.gauges[key] = self.gauges.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = self.series(name, labels)
+        summary = self.summaries.get(key)
+        if summary is None:
+            summary = self.summaries[key] = {'samples': deque(maxlen=self.window), 'sum': 0.0, 'count': 0}
+        summary['samples'].append(seconds)
+        summary['sum'] += seconds
+        summary['count'] += 1
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels]
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    def collect(self):
+        # Stats kept by other components are copied in at scrape time
+        for mode, stats in token_usage.modes.items():
+            self.counters[self.series('tokens_total', {'mode': mode, 'kind': 'prompt'})] = stats['prompt_tokens']
+            self.counters[self.series('tokens_total', {'mode': mode, 'kind': 'output'})] = stats['output_tokens']
+        for result, value in response_cache.stats.items():
+            self.counters[self.series('cache_events_total', {'result': result})] = value
+        for result, value in warm_pool.stats.items():
+            self.counters[self.series('warm_pool_events_total', {'result': result})] = value
+        for result, value in dataset_store.stats.items():
+            self.counters[self.series('dataset_store_events_total', {'result': result})] = value
+        for event, value in sessions.stats.items():
+            self.counters[self.series('session_events_total', {'event': event})] = value
+        self.gauges[self.series('api_requests_in_flight', {})] = api_requests_in_flight
+        self.gauges[self.series('concurrency_limit', {})] = generation_limiter.limit
+        self.gauges[self.series('active_sessions', {})] = len(sessions.sessions)
+
+    def render(self):
+        self.collect()
+        by_name = {}
+        for kind, table in (('counter', self.counters), ('gauge', self.gauges), ('summary', self.summaries)):
+            for (name, labels), value in table.items():
+                by_name.setdefault(name, (kind, []))[1].append((labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, series = by_name[name]
+            full_name = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full_name} {self.help.get(name, (kind, name))[1]}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            for labels, value in sorted(series, key=lambda item: item[0]):
+                if kind != 'summary':
+                    lines.append(f'{full_name}{self.format_labels(labels)} {value}')
+                    continue
+                samples = sorted(value['samples'])
+                for quantile in self.QUANTILES:
+                    observed = samples[min(len(samples) - 1, int(quantile * len(samples)))] if samples else float('nan')
+                    lines.append(f'{full_name}{self.format_labels(labels + (("quantile", str(quantile)),))} {observed}')
+                lines.append(f'{full_name}_sum{self.format_labels(labels)} {value["sum"]}')
+                lines.append(f'{full_name}_count{self.format_labels(labels)} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('model_call_seconds', 'summary', 'Latency of each model call by mode')
+metrics.describe('model_first_chunk_seconds', 'summary', 'Time to the first streamed chunk by mode')
+metrics.describe('generation_seconds', 'summary', 'Latency of a whole generation (batch or story) by mode')
+metrics.describe('model_calls_total', 'counter', 'Model calls by mode and outcome')
+metrics.describe('model_calls_in_flight', 'gauge', 'Model calls currently running')
+metrics.describe('tokens_total', 'counter', 'Prompt and output tokens by mode')
+metrics.describe('retries_total', 'counter', 'Extra model calls made to make up for a short or failed response')
+metrics.describe('rate_limited_total', 'counter', 'Model calls rejected with a rate limit error')
+metrics.describe('concurrency_limit', 'gauge', 'Current adaptive limit on model calls in flight')
+metrics.describe('parse_failures_total', 'counter', 'Model responses that were not valid JSON')
+metrics.describe('dataset_store_events_total', 'counter', 'Seeded dataset lookups (hits, misses) and writes')
+metrics.describe('invalid_records_total', 'counter', 'Records dropped because they failed their schema and could not be repaired')
+metrics.describe('salvaged_people_total', 'counter', 'Complete people recovered from truncated or malformed responses')
+metrics.describe('cache_events_total', 'counter', 'Response cache lookups and evictions by result')
+metrics.describe('warm_pool_events_total', 'counter', 'Warm pool takes by result')
+metrics.describe('api_requests_in_flight', 'gauge', 'HTTP API streams currently open')
+metrics.describe('active_sessions', 'gauge', 'Browser sessions held in memory')
+metrics.describe('session_events_total', 'counter', 'Browser sessions created and evicted after SESSION_IDLE_SECONDS')
+metrics.describe('event_loop_lag_seconds', 'summary', 'How late the event-loop heartbeat woke up')
+metrics.describe('loop_stalls_total', 'counter', 'Event-loop stalls longer than LOOP_STALL_SECONDS by call site and handler')
+
+
+class LoopWatchdog:
+    # A heartbeat task measures event-loop lag. A thread watches the heartbeat and, when it is
+    # overdue by more than stall_seconds, captures the stack the loop thread is stuck in.
+    # The stall is counted and its duration logged once the loop runs again.
+    # Handlers label their task with track(); tasks they start inherit the label.
+    def __init__(self, interval=LOOP_WATCHDOG_INTERVAL, stall_seconds=LOOP_STALL_SECONDS):
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.beat = time.monotonic()
+        self.loop = None
+        self.loop_thread_id = None
+        self.stall = None
+        self.stalls = {}
+        self.activities = weakref.WeakKeyDictionary()
+        self.stopped = threading.Event()
+        self.task = None
+
+    async def start(self):
+        if self.stall_seconds <= 0 or self.task:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        if self.loop.get_task_factory() is None:
+            self.loop.set_task_factory(self.task_factory)
+        self.beat = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.create_task(self.heartbeat())
+        threading.Thread(target=self.watch, name='loop-watchdog', daemon=True).start()
+
+    def task_factory(self, loop, coro, **kwargs):
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+        parent = asyncio.current_task(loop)
+        if parent in self.activities:
+            self.activities[task] = self.activities[parent]
+        return task
+
+    def track(self, handler, mode=None):
+        task = asyncio.current_task()
+        if task is not None:
+            self.activities[task] = (handler, mode)
+
+    async def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.beat = time.monotonic()
+            lag = max(0.0, self.beat - expected)
+            metrics.observe('event_loop_lag_seconds', lag)
+            stall, self.stall = self.stall, None
+            if stall:
+                key = (stall['site'], stall['handler'])
+                self.stalls[key] = self.stalls.get(key, 0) + 1
+                metrics.inc('loop_stalls_total', site=stall['site'], handler=stall['handler'])
+                logger.warning('Event loop was blocked for %.2fs at %s (handler %s, mode %s)',
+                               lag, stall['site'], stall['handler'], stall['mode'])
+
+    def watch(self):
+        while not self.stopped.wait(self.interval / 2):
+            beat = self.beat
+            if self.stall is not None or time.monotonic() - beat < self.interval + self.stall_seconds:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            # The loop may have moved on between the check and the capture
+            if frame is None or self.beat != beat:
+                continue
+            stall = self.describe(frame)
+            task = asyncio.current_task(self.loop)
+            activity = self.activities.get(task) if task else None
+            if activity:
+                stall['handler'], stall['mode'] = activity
+            self.stall = stall
+            logger.warning('Event loop blocked for over %.2fs at %s (handler %s, mode %s)\n%s',
+                           self.stall_seconds, stall['site'], stall['handler'], stall['mode'], stall['stack'])
+
+    @staticmethod
+    def describe(frame):
+        # The call site is the innermost frame of this file; without a tracked activity the
+        # handler is the outermost one and the mode the first `mode` variable found
+        stack = ''.join(traceback.format_stack(frame))
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        own = [f for f in frames if f.f_code.co_filename == __file__]
+        site = own[0] if own else frames[0]
+        handlers = [f for f in own if f.f_code.co_name not in ('<lambda>', '<module>')]
+        handler = handlers[-1].f_code.co_name if handlers else None
+        mode = None
+        for f in reversed(own):
+            try:
+                value = f.f_locals.get('mode')
+            except Exception:
+                continue
+            # main_page's `mode` is a ui.select, not a mode name
+            if isinstance(value, str):
+                mode = value
+                break
+        return {
+            'site': f'{os.path.basename(site.f_code.co_filename)}:{site.f_lineno} {site.f_code.co_name}',
+            'handler': handler,
+            'mode': mode,
+            'stack': stack,
+        }
+
+
+loop_watchdog = LoopWatchdog()
+app.on_startup(loop_watchdog.start)
+app.on_shutdown(loop_watchdog.stop)
+
+
+def estimate_tokens(text):
+    # Rough rule of thumb for English text, used where no usage metadata exists
+    return max(1, len(text) // 4)
+
+
+class GeminiBackend:
+    def __init__(self, model_name=GEMINI_MODEL, api_key=GEMINI_API_KEY):
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def generation_config(mode, count):
+        return genai.GenerationConfig(response_mime_type='application/json', response_schema=response_schema(mode, count))
+
+    @staticmethod
+    def record_usage(mode, usage):
+        if usage:
+            token_usage.record(mode, usage.prompt_token_count, usage.candidates_token_count)
+
+    async def generate(self, prompt, mode='regular', count=1, shard=0, seed=None):
+        # This SDK's GenerationConfig has no seed, so seeded output is pinned by the dataset store instead
+        response = await self.model.generate_content_async(prompt, generation_config=self.generation_config(mode, count))
+        self.record_usage(mode, response.usage_metadata)
+        return ModelResponse(response.text)
+
+    async def stream(self, prompt, mode='regular', count=1, shard=0, seed=None):
+        response = await self.model.generate_content_async(
+            prompt, generation_config=self.generation_config(mode, count), stream=True
+        )
+        # Usage metadata arrives with the final chunk
+        usage = None
+        async for chunk in response:
+            usage = chunk.usage_metadata or usage
+            if chunk.parts:
+                yield chunk.text
+        self.record_usage(mode, usage)
+
+
+FAKE_FIRST_NAMES = ['Ada', 'Bram', 'Cleo', 'Dario', 'Elif', 'Finn', 'Greta', 'Hiro', 'Ines', 'Jonas',
+                    'Kaia', 'Luca', 'Mira', 'Nils', 'Odette', 'Priya', 'Quinn', 'Rosa', 'Soren', 'Tala']
+FAKE_LAST_NAMES = ['Abbott', 'Brandt', 'Castillo', 'Dubois', 'Eriksen', 'Fontaine', 'Gallo', 'Hartmann',
+                   'Ibsen', 'Jensen', 'Kowalski', 'Lindqvist', 'Moreau', 'Novak', 'Okafor', 'Petrov']
+FAKE_STREETS = ['Maple Ave', 'Harbor St', 'Juniper Rd', 'Quarry Ln', 'Willow Way', 'Beacon Blvd']
+FAKE_CITIES = ['Springfield, IL', 'Portland, OR', 'Madison, WI', 'Savannah, GA', 'Boulder, CO']
+FAKE_OCCUPATIONS = ['Accountant', 'Nurse', 'Civil Engineer', 'Librarian', 'Chef', 'Electrician', 'Teacher']
+FAKE_SURPRISE_OCCUPATIONS = ['Professional Panda Nanny', 'Ethical Hacker', 'Iceberg Mover',
+                             'Fortune Cookie Writer', 'Golf Ball Diver', 'Odor Tester']
+FAKE_TITLES = ['Knight', 'Sorceress', 'Ranger', 'Alchemist', 'Oracle', 'Tinkerer', 'Warden']
+FAKE_TRAITS = ['Brave', 'Cunning', 'Loyal', 'Reckless', 'Wise', 'Stubborn', 'Curious', 'Silver-tongued']
+FAKE_EQUIPMENT = ['Rusty Sword', 'Brass Goggles', 'Spell Tome', 'Grappling Hook', 'Lantern', 'Map Case']
+
+
+class FakeBackend:
+    # Offline stand-in that answers every prompt with schema-valid JSON.
+    # Output depends only on the seed, the shard, the prompt and how often that prompt was seen,
+    # so runs are reproducible even when calls complete out of order.
+    def __init__(self, latency=FAKE_MODEL_LATENCY, failure_rate=FAKE_MODEL_FAILURE_RATE, seed=FAKE_MODEL_SEED,
+                 truncation_rate=FAKE_MODEL_TRUNCATION_RATE, invalid_rate=FAKE_MODEL_INVALID_RATE, stream_chunks=8,
+                 blocking=FAKE_MODEL_BLOCKING, max_prompts=4096):
+        self.latency = latency
+        self.blocking = blocking
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.truncation_rate = truncation_rate
+        self.invalid_rate = invalid_rate
+        self.stream_chunks = stream_chunks
+        # How often each recent prompt was answered, least recently used first; a prompt that
+        # falls out of this window starts its answers from the beginning again
+        self.prompt_counts = OrderedDict()
+        self.max_prompts = max_prompts
+        self.failure_rng = random.Random(seed)
+        self.truncation_rng = random.Random(seed)
+        self.invalid_rng = random.Random(seed)
+
+    async def generate(self, prompt, mode='regular', count=1, shard=0, seed=None):
+        text = self.respond(prompt, mode, count, shard, seed)
+        if self.latency:
+            await self.wait(self.latency)
+        self.maybe_fail()
+        return ModelResponse(text)
+
+    async def stream(self, prompt, mode='regular', count=1, shard=0, seed=None):
+        text = self.respond(prompt, mode, count, shard, seed)
+        step = max(1, -(-len(text) // self.stream_chunks))
+        for start in range(0, len(text), step):
+            if self.latency:
+                await self.wait(self.latency / self.stream_chunks)
+            if start == 0:
+                self.maybe_fail()
+            yield text[start:start + step]
+
+    async def wait(self, seconds):
+        if self.blocking:
+            time.sleep(seconds)
+        else:
+            await asyncio.sleep(seconds)
+
+    def maybe_fail(self):
+        if self.failure_rng.random() < self.failure_rate:
+            raise google_exceptions.ResourceExhausted('Fake backend injected rate limit')
+
+    def respond(self, prompt, mode, count, shard=0, seed=None):
+        text = self.build_response(prompt, mode, count, shard, seed)
+        # Mimics a response cut off by the output token limit
+        if len(text) > 1 and self.truncation_rng.random() < self.truncation_rate:
+            text = text[:self.truncation_rng.randint(1, len(text) - 1)]
+        token_usage.record(mode, estimate_tokens(prompt), estimate_tokens(text))
+        return text
+
+    def build_response(self, prompt, mode, count, shard=0, seed=None):
+        if seed is None:
+            occurrence = self.prompt_counts.pop(prompt, 0)
+            self.prompt_counts[prompt] = occurrence + 1
+            if len(self.prompt_counts) > self.max_prompts:
+                self.prompt_counts.popitem(last=False)
+            rng = random.Random(f'{self.seed}:{shard}:{occurrence}:{prompt}')
+        else:
+            # A seeded request must not depend on what this process generated before
+            rng = random.Random(f'seed {seed}:{shard}:{prompt}')
+
+        match = re.search(r'Name: (.+)', prompt)
+        name = match.group(1).strip() if match else 'Someone'
+        if mode == 'story':
+            data = self.fake_story(rng, name)
+        elif mode == 'story_outline':
+            data = self.fake_story(rng, name, chapter_count=count)
+            for chapter in data['chapters']:
+                chapter['beat'] = chapter.pop('content')
+        elif mode == 'story_chapter':
+            heading = re.search(r'Chapter heading: (.+)', prompt)
+            data = {
+                "heading": heading.group(1).strip() if heading else 'Chapter',
+                "content": f"{name} faced a {rng.choice(FAKE_TRAITS).lower()} choice."
+            }
+        elif mode == 'story_epilogue':
+            data = {"epilogue": f"{name} lived on."}
+        elif mode == 'fantasy':
+            data = {"people": [self.fake_fantasy_person(rng) for _ in range(count)]}
+        elif mode == 'regular_names':
+            people = [self.fake_person(rng) for _ in range(count)]
+            data = {"people": [{"full_name": p['full_name'], "occupation": p['occupation']} for p in people]}
+        elif mode in ('regular', 'surprise'):
+            data = {"people": [self.fake_person(rng, surprise=mode == 'surprise') for _ in range(count)]}
+        else:
+            data = {"people": [self.fake_record(rng, RECORD_SCHEMAS[mode].fields) for _ in range(count)]}
+
+        if 'people' in data and self.invalid_rate:
+            # Mimics records the model got wrong by dropping one of their fields
+            for person in data['people']:
+                if self.invalid_rng.random() < self.invalid_rate:
+                    del person[self.invalid_rng.choice(list(person))]
+        return json.dumps(data)
+
+    def fake_person(self, rng, surprise=False):
+        first = rng.choice(FAKE_FIRST_NAMES)
+        last = rng.choice(FAKE_LAST_NAMES)
+        tag = rng.randint(1, 9999)
+        return {
+            "full_name": f"{first} {last}",
+            "email": f"{first.lower()}.{last.lower()}{tag}@example.com",
+            "address": f"{rng.randint(1, 9999)} {rng.choice(FAKE_STREETS)}, {rng.choice(FAKE_CITIES)}",
+            "phone_number": f"({rng.randint(200, 999)}) 555-{rng.randint(0, 9999):04d}",
+            "occupation": rng.choice(FAKE_SURPRISE_OCCUPATIONS if surprise else FAKE_OCCUPATIONS)
+        }
+
+    def fake_record(self, rng, spec, name='value'):
+        # Any record schema: lists get one to three items and strings are labelled by their field
+        if isinstance(spec, list):
+            return [self.fake_record(rng, spec[0], name) for _ in range(rng.randint(1, 3))]
+        if isinstance(spec, dict):
+            return {key: self.fake_record(rng, field, key) for key, field in spec.items()}
+        if spec in ('integer', 'number'):
+            return rng.randint(1, 99)
+        if spec == 'boolean':
+            return rng.random() < 0.5
+        if name == 'full_name':
+            return f"{rng.choice(FAKE_FIRST_NAMES)} {rng.choice(FAKE_LAST_NAMES)}"
+        return f"{name.replace('_', ' ').title()} {rng.randint(1, 9999)}"
+
+    def fake_fantasy_person(self, rng):
+        title = rng.choice(FAKE_TITLES)
+        name = f"{rng.choice(FAKE_FIRST_NAMES)} of {rng.choice(FAKE_LAST_NAMES)} {rng.randint(1, 9999)}"
+        return {
+            "full_name": name,
+            "title": title,
+            "age": str(rng.randint(16, 400)),
+            "origin": rng.choice(FAKE_CITIES).split(',')[0],
+            "occupation": title,
+            "special_traits": rng.sample(FAKE_TRAITS, 3),
+            "equipment": rng.sample(FAKE_EQUIPMENT, 3),
+            "relationships": [{"type": "Rival", "to": f"{rng.choice(FAKE_FIRST_NAMES)} {rng.choice(FAKE_LAST_NAMES)}"}],
+            "backstory": f"{name} left home young and became a {title.lower()} of some renown."
+        }
+
+    def fake_story(self, rng, name, chapter_count=None):
+        chapters = [
+            {"heading": f"Chapter {i + 1}", "content": f"{name} faced a {rng.choice(FAKE_TRAITS).lower()} choice."}
+            for i in range(chapter_count or rng.randint(2, 4))
+        ]
+        return {"title": f"The Tale of {name}", "chapters": chapters, "epilogue": f"{name} lived on."}
+
+
+class CassetteBackend:
+    # Records responses from an inner backend to a JSONL cassette, or replays them
+    # offline when no inner backend is given. Repeated prompts replay in recorded order.
+    def __init__(self, path=CASSETTE_PATH, inner=None):
+        self.path = path
+        self.inner = inner
+        self.recordings = {}
+        self.replay_positions = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recordings.setdefault(entry['key'], []).append(entry['text'])
+
+    @staticmethod
+    def prompt_key(prompt):
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    async def generate(self, prompt, mode='regular', count=1, shard=0, seed=None):
+        key = self.prompt_key(prompt)
+        if self.inner is None:
+            recorded = self.recordings.get(key)
+            if not recorded:
+                raise KeyError(f'No recorded response for prompt {key[:12]} in {self.path}')
+            position = self.replay_positions.get(key, 0)
+            self.replay_positions[key] = position + 1
+            return ModelResponse(recorded[position % len(recorded)])
+
+        response = await self.inner.generate(prompt, mode=mode, count=count, shard=shard, seed=seed)
+        self.record(key, mode, prompt, response.text)
+        return response
+
+    async def stream(self, prompt, mode='regular', count=1, shard=0, seed=None):
+        if self.inner is None:
+            response = await self.generate(prompt, mode=mode, count=count, shard=shard, seed=seed)
+            yield response.text
+            return
+
+        chunks = []
+        async for chunk in self.inner.stream(prompt, mode=mode, count=count, shard=shard, seed=seed):
+            chunks.append(chunk)
+            yield chunk
+        self.record(self.prompt_key(prompt), mode, prompt, ''.join(chunks))
+
+    def record(self, key, mode, prompt, text):
+        self.recordings.setdefault(key, []).append(text)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'key': key, 'mode': mode, 'prompt': prompt, 'text': text}) + '\n')
+
+
+def create_backend(name=MODEL_BACKEND):
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'fake':
+        return FakeBackend()
+    if name == 'record':
+        return CassetteBackend(CASSETTE_PATH, inner=GeminiBackend())
+    if name == 'replay':
+        return CassetteBackend(CASSETTE_PATH)
+    raise ValueError(f'Unknown model backend: {name}')
+
+
+backend = create_backend()
+
+
+# Per-locale pools and templates for the local generator (see compile_template). US phone
+# numbers stay in the 555-01xx range reserved for fiction.
+LOCAL_LOCALES = {
+    'en_US': {
+        'first_names': ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+                        'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+                        'Carlos', 'Maria', 'Daniel', 'Karen', 'Matthew', 'Nancy', 'Anthony', 'Lisa', 'Mark', 'Betty'],
+        'last_names': ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+                       'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore',
+                       'Jackson', 'Martin', 'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Lewis'],
+        'streets': ['Main St', 'Oak Ave', 'Maple Dr', 'Cedar Ln', 'Pine St', 'Elm St', 'Washington Ave', 'Lake Rd',
+                    'Hill St', 'Park Ave', 'Sunset Blvd', 'River Rd'],
+        'cities': ['Springfield, IL', 'Portland, OR', 'Madison, WI', 'Savannah, GA', 'Boulder, CO', 'Austin, TX',
+                   'Raleigh, NC', 'Tucson, AZ', 'Albany, NY', 'Columbus, OH'],
+        'address': '{number} {street}, {city} {postcode}',
+        'postcode': '#####',
+        'phone': '(2##) 555-01##'
+    },
+    'en_GB': {
+        'first_names': ['Oliver', 'Amelia', 'George', 'Isla', 'Harry', 'Ava', 'Jack', 'Olivia', 'Charlie', 'Emily',
+                        'Thomas', 'Sophie', 'Alfie', 'Grace', 'Oscar', 'Freya', 'William', 'Poppy', 'Arthur', 'Evie'],
+        'last_names': ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies', 'Robinson',
+                       'Wright', 'Thompson', 'Evans', 'Walker', 'White', 'Roberts', 'Green', 'Hall', 'Wood', 'Clarke'],
+        'streets': ['High Street', 'Station Road', 'Church Lane', 'Victoria Road', 'Mill Lane', 'Park Road',
+                    'The Crescent', 'Kings Road', 'Queens Road', 'New Street'],
+        'cities': ['London', 'Leeds', 'Bristol', 'York', 'Norwich', 'Bath', 'Oxford', 'Cardiff', 'Exeter', 'Durham'],
+        'address': '{number} {street}, {city} {postcode}',
+        'postcode': '??# #??',
+        'phone': '+44 7700 900###'
+    },
+    'de_DE': {
+        'first_names': ['Lukas', 'Anna', 'Jonas', 'Lea', 'Felix', 'Hannah', 'Maximilian', 'Lena', 'Paul', 'Marie',
+                        'Jürgen', 'Sophie', 'Tobias', 'Katharina', 'Stefan', 'Julia', 'Matthias', 'Sabine', 'Uwe', 'Jana'],
+        'last_names': ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker', 'Schulz',
+                       'Hoffmann', 'Schäfer', 'Koch', 'Bauer', 'Richter', 'Klein', 'Wolf', 'Schröder', 'Neumann'],
+        'streets': ['Hauptstraße', 'Schulstraße', 'Gartenstraße', 'Bahnhofstraße', 'Dorfstraße', 'Bergstraße',
+                    'Lindenstraße', 'Kirchweg', 'Waldweg', 'Am Markt'],
+        'cities': ['Berlin', 'Hamburg', 'München', 'Köln', 'Leipzig', 'Dresden', 'Bremen', 'Freiburg', 'Kassel', 'Ulm'],
+        'address': '{street} {number}, {postcode} {city}',
+        'postcode': '#####',
+        'phone': '+49 15## #######'
+    },
+    'fr_FR': {
+        'first_names': ['Léa', 'Hugo', 'Chloé', 'Louis', 'Manon', 'Gabriel', 'Camille', 'Arthur', 'Inès', 'Jules',
+                        'Élodie', 'Théo', 'Zoé', 'Raphaël', 'Margaux', 'Lucas', 'Anaïs', 'Nathan', 'Océane', 'Mathis'],
+        'last_names': ['Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy',
+                       'Moreau', 'Simon', 'Laurent', 'Lefèvre', 'Michel', 'Garcia', 'David', 'Bertrand', 'Roux'],
+        'streets': ['rue de la Paix', 'avenue Victor Hugo', 'rue du Moulin', 'boulevard Voltaire', 'rue des Écoles',
+                    'place de la République', 'rue Pasteur', 'chemin des Vignes', 'rue de la Gare', 'allée des Tilleuls'],
+        'cities': ['Paris', 'Lyon', 'Marseille', 'Toulouse', 'Nantes', 'Lille', 'Bordeaux', 'Rennes', 'Nice', 'Dijon'],
+        'address': '{number} {street}, {postcode} {city}',
+        'postcode': '#####',
+        'phone': '+33 6 ## ## ## ##'
+    }
+}
+LOCAL_OCCUPATIONS = ['Accountant', 'Nurse', 'Civil Engineer', 'Librarian', 'Chef', 'Electrician', 'Teacher',
+                     'Software Developer', 'Pharmacist', 'Architect', 'Plumber', 'Graphic Designer', 'Paramedic',
+                     'Data Analyst', 'Carpenter', 'Veterinarian', 'Journalist', 'Dental Hygienist', 'Pilot',
+                     'Marketing Manager', 'Social Worker', 'Mechanic', 'Translator', 'Lawyer']
+LOCAL_EMAIL_DOMAINS = ['example.com', 'example.net', 'example.org']
+
+
+@lru_cache(maxsize=None)
+def digit_strings(width):
+    return [f'{number:0{width}d}' for number in range(10 ** width)]
+
+
+def compile_template(template, fields=None):
+    # Turns a template into a format string of bare '{}' placeholders plus one population of
+    # ready-made strings per placeholder: runs of '#' are digit strings (at most four digits each),
+    # '?' is a letter and {name} is a value from fields[name], so
+    # '(2##) 555-01##' -> ('(2{}) 555-01{}', [digit_strings(2), digit_strings(2)])
+    parts, populations = [], []
+    for run in re.findall(r'\{\w+\}|#{1,4}|\?|[^#?{]+', template):
+        if run.startswith('{'):
+            parts.append('{}')
+            populations.append(fields[run[1:-1]])
+        elif run.startswith('#'):
+            parts.append('{}')
+            populations.append(digit_strings(len(run)))
+        elif run == '?':
+            parts.append('{}')
+            populations.append(string.ascii_uppercase)
+        else:
+            parts.append(run.replace('{', '{{').replace('}', '}}'))
+    return ''.join(parts), populations
+
+
+@lru_cache(maxsize=65536)
+def email_local_part(full_name):
+    # 'Élodie Lefèvre' -> 'elodie.lefevre'
+    ascii_name = unicodedata.normalize('NFKD', full_name).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '.', ascii_name.lower()).strip('.') or 'person'
+
+
+class LocalGenerator:
+    # Seeded, model-free source of Regular mode people. Each field is drawn for the whole batch
+    # at once (one rng.choices call per column) and the rows are zipped together at the end.
+    # Like FakeBackend, output depends only on the seed, the locale, the shard and how often
+    # that shard was requested (or just the request's seed and the shard, when one is given),
+    # so resumed CLI runs reproduce exactly.
+    def __init__(self, locale=LOCAL_GENERATOR_LOCALE, seed=LOCAL_GENERATOR_SEED):
+        if locale not in LOCAL_LOCALES:
+            raise ValueError(f"Unknown locale {locale}; expected one of: {', '.join(LOCAL_LOCALES)}")
+        self.locale = locale
+        self.seed = seed
+        self.tables = LOCAL_LOCALES[locale]
+        self.phone = compile_template(self.tables['phone'])
+        self.address = compile_template(
+            self.tables['address'].replace('{postcode}', self.tables['postcode']),
+            {'number': [str(number) for number in range(1, 2000)], 'street': self.tables['streets'], 'city': self.tables['cities']}
+        )
+        self.shard_counts = {}
+
+    def rng(self, shard=0, seed=None):
+        if seed is not None:
+            return random.Random(f'seed {seed}:{self.locale}:{shard}')
+        occurrence = self.shard_counts.get(shard, 0)
+        self.shard_counts[shard] = occurrence + 1
+        return random.Random(f'{self.seed}:{self.locale}:{shard}:{occurrence}')
+
+    @staticmethod
+    def fill_template(rng, template, count):
+        pattern, populations = template
+        return list(map(pattern.format, *(rng.choices(population, k=count) for population in populations)))
+
+    def fill(self, rng, names, occupations):
+        # Email, phone and address for people whose names and occupations are already known
+        count = len(names)
+        emails = [
+            f'{email_local_part(name)}{tag}@{domain}'
+            for name, tag, domain in zip(names, rng.choices(range(1, 10 ** 8), k=count),
+                                         rng.choices(LOCAL_EMAIL_DOMAINS, k=count))
+        ]
+        addresses = self.fill_template(rng, self.address, count)
+        phones = self.fill_template(rng, self.phone, count)
+        return [
+            {"full_name": name, "email": email, "address": address, "phone_number": phone, "occupation": occupation}
+            for name, email, address, phone, occupation in zip(names, emails, addresses, phones, occupations)
+        ]
+
+    def people(self, count, shard=0, seed=None):
+        rng = self.rng(shard, seed)
+        names = [
+            f'{first} {last}' for first, last in zip(rng.choices(self.tables['first_names'], k=count),
+                                                    rng.choices(self.tables['last_names'], k=count))
+        ]
+        return self.fill(rng, names, rng.choices(LOCAL_OCCUPATIONS, k=count))
+
+
+if REGULAR_GENERATOR not in ('model', 'hybrid', 'local'):
+    raise ValueError(f'Unknown regular generator: {REGULAR_GENERATOR}')
+local_generator = LocalGenerator()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, db_path=CACHE_DB_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self.db = None
+        # Disk reads and writes run in worker threads that share the one connection
+        self.lock = threading.Lock()
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, text TEXT NOT NULL, stored_at REAL NOT NULL)'
+            )
+            self.db.execute('DELETE FROM responses WHERE stored_at < ?', (time.time() - ttl,))
+            self.db.commit()
+
+    @staticmethod
+    def make_key(prompt, **params):
+        normalized = ' '.join(prompt.split())
+        payload = json.dumps({'prompt': normalized, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def get(self, key):
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry:
+            stored_at, text = entry
+            if now - stored_at <= self.ttl:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return text
+            del self.entries[key]
+            self.stats['expirations'] += 1
+
+        if self.db:
+            row = await asyncio.to_thread(self.read_disk, key)
+            if row and now - row[1] <= self.ttl:
+                self.stats['hits'] += 1
+                self.stats['disk_hits'] += 1
+                self.remember(key, row[0], row[1])
+                return row[0]
+
+        self.stats['misses'] += 1
+        return None
 
-def generate_fantasy_data(count=1, fantasy_type='Time Travel', subtype='Medieval (500 - 1500)'):
+    async def put(self, key, text):
+        stored_at = time.time()
+        self.remember(key, text, stored_at)
+        if self.db:
+            await asyncio.to_thread(self.write_disk, key, text, stored_at)
+
+    def remember(self, key, text, stored_at):
+        self.entries[key] = (stored_at, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def read_disk(self, key):
+        with self.lock:
+            return self.db.execute('SELECT text, stored_at FROM responses WHERE key = ?', (key,)).fetchone()
+
+    def write_disk(self, key, text, stored_at):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses (key, text, stored_at) VALUES (?, ?, ?)', (key, text, stored_at))
+            self.db.commit()
+
+
+response_cache = ResponseCache()
+
+
+def notify(message, type='info'):
+    # Generators also run headless (CLI, background refills) where there is no page to notify
     try:
-        prompt = f"""Generate {count} unique fantasy character(s) based on:
-        Type: {fantasy_type}
-        Setting: {subtype}
-        
-        Return ONLY a valid JSON object with this exact format:
-        {{
-            "people": [
-                {{
-                    "full_name": "fantasy name",
-                    "title": "character title",
-                    "age": "age",
-                    "origin": "place of origin",
-                    "occupation": "role or profession",
-                    "special_traits": ["trait1", "trait2", "trait3"],
-                    "equipment": ["item1", "item2", "item3"],
-                    "relationships": [
-                        {{"type": "relationship type", "to": "other character name"}}
-                    ],
-                    "backstory": "character background story"
-                }}
-            ]
-        }}
-        
-        Make the characters fit the {fantasy_type} setting of {subtype}.
-        Ensure all details are creative and consistent with the setting."""
+        ui.notify(message, type=type)
+    except RuntimeError:
+        logger.debug('No client to notify: %s', message)
+
+
+class JsonStreamParser:
+    # Incremental scanner for model output. Leading prose and code fences are skipped,
+    # and feed() returns (path, value) for each value that completes within max_depth:
+    # scalars by key, containers only as array items. With the default depth that is
+    # every person in {"people": [...]} or [...], and every chapter of a story.
+    STRING_SPECIAL = re.compile(r'["\\]')
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.buffer = ''
+        self.pos = 0
+        # Frames are [bracket, start, key or index, expecting_key]
+        self.stack = []
+        self.in_string = False
+        self.token_start = None
+        self.root_span = None
+
+    @property
+    def done(self):
+        return self.root_span is not None
+
+    def feed(self, chunk):
+        events = []
+        self.buffer += chunk
+        buffer = self.buffer
+        end = len(buffer)
+        pos = self.pos
+        while pos < end and self.root_span is None:
+            if self.in_string:
+                match = self.STRING_SPECIAL.search(buffer, pos)
+                if not match:
+                    pos = end
+                    break
+                pos = match.start()
+                if buffer[pos] == '\\':
+                    if pos + 1 >= end:
+                        break
+                    pos += 2
+                    continue
+                self.in_string = False
+                self.close_string(pos + 1, events)
+                pos += 1
+                continue
+
+            char = buffer[pos]
+            if not self.stack:
+                if char in '{[':
+                    self.stack.append([char, pos, None if char == '{' else 0, char == '{'])
+                pos += 1
+                continue
+
+            if self.token_start is not None:
+                if char not in ' \t\r\n,}]':
+                    pos += 1
+                    continue
+                self.complete(self.token_start, pos, False, events)
+                self.token_start = None
+
+            frame = self.stack[-1]
+            if char == '"':
+                self.in_string = True
+                self.token_start = pos
+            elif char in '{[':
+                self.stack.append([char, pos, None if char == '{' else 0, char == '{'])
+            elif char in '}]':
+                self.stack.pop()
+                self.complete(frame[1], pos + 1, True, events)
+            elif char == ',':
+                if frame[0] == '[':
+                    frame[2] += 1
+                else:
+                    frame[3] = True
+            elif char not in ' \t\r\n:':
+                self.token_start = pos
+            pos += 1
+        self.pos = pos
+        return events
+
+    def close_string(self, end, events):
+        start = self.token_start
+        self.token_start = None
+        frame = self.stack[-1]
+        if frame[3]:
+            frame[2] = json.loads(self.buffer[start:end])
+            frame[3] = False
+        else:
+            self.complete(start, end, False, events)
+
+    def complete(self, start, end, is_container, events):
+        if not self.stack:
+            self.root_span = (start, end)
+            return
+        if len(self.stack) > self.max_depth:
+            return
+        if is_container and self.stack[-1][0] != '[':
+            return
+        try:
+            value = json.loads(self.buffer[start:end])
+        except ValueError:
+            return
+        events.append((tuple(frame[2] for frame in self.stack), value))
+
+    def parse_root(self):
+        if self.root_span is None:
+            raise ValueError('No complete JSON value in model response')
+        start, end = self.root_span
+        return json.loads(self.buffer[start:end])
+
+
+def parse_json_response(text):
+    # Structured output is plain JSON; the tolerant parser still handles code fences
+    # and leading prose from recorded cassettes or older cached responses
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    parser = JsonStreamParser(max_depth=0)
+    parser.feed(text)
+    return parser.parse_root()
+
 
-        response = model.generate_content(prompt)
-        data = process_response(response)
+def normalize_people(data):
+    if isinstance(data, dict) and 'people' in data:
+        return data
+    elif isinstance(data, list):
+        return {"people": data}
+    else:
+        return {"people": [data]}
+
+
+def is_person_event(path, value):
+    # A person is an object item of the top-level list or of the "people" list
+    return isinstance(value, dict) and isinstance(path[-1], int) and (len(path) == 1 or path[0] == 'people')
+
+
+def parses_as_json(text):
+    try:
+        parse_json_response(text)
+        return True
+    except ValueError:
+        return False
+
+
+class TokenBucket:
+    # Refills continuously at rate_per_minute and holds at most one minute's worth.
+    # Waiters are served in arrival order; a rate of 0 disables the bucket.
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        if not self.rate:
+            return
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+    def debit(self, amount):
+        # Charges usage only known after the call; the balance may go negative until it refills
+        if self.rate:
+            self.refill()
+            self.tokens -= amount
+
+
+class AdaptiveConcurrency:
+    # AIMD limit on model calls in flight: halves on a rate limit or server error (at most
+    # once per cooldown, so one burst of failures counts once) and grows by one after a
+    # full limit's worth of successes, staying between min_limit and max_limit.
+    def __init__(self, max_limit=MAX_CONCURRENT_GENERATIONS, min_limit=1, cooldown=1.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.cooldown = cooldown
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record_success(self):
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self.successes = 0
+
+    def record_failure(self):
+        now = time.monotonic()
+        if now - self.last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.last_decrease = now
+        self.successes = 0
+
+
+generation_limiter = AdaptiveConcurrency()
+request_bucket = TokenBucket(MODEL_RPM)
+token_bucket = TokenBucket(MODEL_TPM)
+
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError
+)
+
+
+async def wait_for_quota(prompt):
+    await request_bucket.acquire()
+    await token_bucket.acquire(estimate_tokens(prompt))
+
+
+async def back_off(mode, attempt, error):
+    # Full jitter: a random delay up to the exponential cap spreads retries from concurrent callers
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        metrics.inc('rate_limited_total', mode=mode)
+    delay = random.uniform(0, min(MODEL_RETRY_MAX_DELAY, MODEL_RETRY_BASE_DELAY * 2 ** attempt))
+    metrics.inc('retries_total', mode=mode)
+    logger.warning('%s call failed (%s); retry %d in %.1fs', mode, error, attempt + 1, delay)
+    await asyncio.sleep(delay)
+
+
+async def generate_content(prompt, mode='regular', count=1, shard=0, use_cache=True, seed=None):
+    # Awaits the model without blocking the event loop, so other sessions keep running.
+    # mode and count select Gemini's response schema; shard and seed are hints for offline backends.
+    # Only responses that parse are cached, so broken output is never served again.
+    cache_key = ResponseCache.make_key(
+        prompt, mode=mode, count=count, shard=shard, seed=seed, backend=MODEL_BACKEND, model=GEMINI_MODEL
+    )
+    if use_cache:
+        text = await response_cache.get(cache_key)
+        if text is not None:
+            return ModelResponse(text, cached=True)
+
+    for attempt in range(MODEL_MAX_RETRIES + 1):
+        await wait_for_quota(prompt)
+        async with generation_limiter:
+            metrics.add('model_calls_in_flight', 1)
+            started = time.perf_counter()
+            try:
+                response = await backend.generate(prompt, mode=mode, count=count, shard=shard, seed=seed)
+                generation_limiter.record_success()
+                break
+            except RETRYABLE_ERRORS as e:
+                metrics.inc('model_calls_total', mode=mode, outcome='error')
+                generation_limiter.record_failure()
+                if attempt == MODEL_MAX_RETRIES:
+                    raise
+                error = e
+            except Exception:
+                metrics.inc('model_calls_total', mode=mode, outcome='error')
+                raise
+            finally:
+                metrics.add('model_calls_in_flight', -1)
+        await back_off(mode, attempt, error)
+
+    metrics.observe('model_call_seconds', time.perf_counter() - started, mode=mode)
+    metrics.inc('model_calls_total', mode=mode, outcome='ok')
+    token_bucket.debit(estimate_tokens(response.text))
+    logger.debug('%s call returned %d characters', mode, len(response.text))
+    if parses_as_json(response.text):
+        await response_cache.put(cache_key, response.text)
+    else:
+        metrics.inc('parse_failures_total', mode=mode)
+    return ModelResponse(response.text)
+
+
+async def stream_content(prompt, mode='regular', count=1, shard=0, use_cache=True, seed=None):
+    # Streaming counterpart of generate_content, yielding text chunks as they arrive.
+    # A failed call is only retried if it failed before its first chunk was yielded.
+    cache_key = ResponseCache.make_key(
+        prompt, mode=mode, count=count, shard=shard, seed=seed, backend=MODEL_BACKEND, model=GEMINI_MODEL
+    )
+    if use_cache:
+        text = await response_cache.get(cache_key)
+        if text is not None:
+            yield text
+            return
+
+    chunks = []
+    for attempt in range(MODEL_MAX_RETRIES + 1):
+        await wait_for_quota(prompt)
+        async with generation_limiter:
+            metrics.add('model_calls_in_flight', 1)
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                async for chunk in backend.stream(prompt, mode=mode, count=count, shard=shard, seed=seed):
+                    if not chunks:
+                        metrics.observe('model_first_chunk_seconds', time.perf_counter() - started, mode=mode)
+                    chunks.append(chunk)
+                    yield chunk
+                outcome = 'ok'
+                generation_limiter.record_success()
+            except (asyncio.CancelledError, GeneratorExit):
+                outcome = 'cancelled'
+                raise
+            except RETRYABLE_ERRORS as e:
+                generation_limiter.record_failure()
+                if chunks or attempt == MODEL_MAX_RETRIES:
+                    raise
+                error = e
+            finally:
+                metrics.add('model_calls_in_flight', -1)
+                metrics.inc('model_calls_total', mode=mode, outcome=outcome)
+        if outcome == 'ok':
+            break
+        await back_off(mode, attempt, error)
+
+    metrics.observe('model_call_seconds', time.perf_counter() - started, mode=mode)
+    text = ''.join(chunks)
+    token_bucket.debit(estimate_tokens(text))
+    logger.debug('%s stream returned %d characters', mode, len(text))
+    if parses_as_json(text):
+        await response_cache.put(cache_key, text)
+    else:
+        metrics.inc('parse_failures_total', mode=mode)
+
+
+def fantasy_data_prompt(count, fantasy_type, subtype):
+    return (
+        f"Generate {count} unique fantasy characters for the {fantasy_type} setting \"{subtype}\". "
+        "Give each three special traits, three pieces of equipment, at least one relationship and a short backstory, "
+        "all consistent with the setting."
+    )
+
+
+async def generate_fantasy_data(count=1, fantasy_type='Time Travel', subtype='Medieval (500 - 1500)', shard=0, use_cache=True,
+                                seed=None):
+    try:
+        prompt = build_people_prompt('fantasy', count, fantasy_type, subtype)
+        response = await generate_content(prompt, mode='fantasy', count=count, shard=shard, use_cache=use_cache, seed=seed)
+        data = process_response(response, mode='fantasy')
         return data
 
     except Exception as e:
-        print(f"Error generating fantasy data: {str(e)}")
-        ui.notify(f'Error generating fantasy data: {str(e)}', type='error')
+        logger.error('Error generating fantasy data: %s', e)
+        notify(f'Error generating fantasy data: {str(e)}', type='error')
         return None
 
-def generate_character_story(character_data):
+def character_details(character_data):
+    fields = [('Title', 'title'), ('Origin', 'origin'), ('Backstory', 'backstory')]
+    lines = [
+        f"Name: {character_data.get('full_name', 'Unknown')}",
+        f"Occupation: {character_data.get('occupation', 'Unknown')}"
+    ]
+    lines += [f"{label}: {character_data[key]}" for label, key in fields if character_data.get(key)]
+    return '\n'.join(lines)
+
+
+def character_story_prompt(character_data):
+    return (
+        "Write an engaging short story in chapters about this character: a day in their life, a significant event, "
+        f"their hopes and dreams, and their challenges. End with a brief epilogue.\n{character_details(character_data)}"
+    )
+
+
+def story_outline_prompt(character_data, chapter_count=STORY_CHAPTERS):
+    return (
+        f"Outline a {chapter_count}-chapter short story about this character covering a day in their life, "
+        "a significant event, their hopes and dreams, and their challenges. Give each chapter a heading and a "
+        f"one-sentence beat.\n{character_details(character_data)}"
+    )
+
+
+def story_chapter_prompt(character_data, outline, index):
+    chapter = outline['chapters'][index]
+    plan = '\n'.join(
+        f"{i + 1}. {beat.get('heading', '')}: {beat.get('beat', '')}" for i, beat in enumerate(outline['chapters'])
+    )
+    return (
+        f"Write chapter {index + 1} of the story \"{outline.get('title', '')}\", engaging and following its beat.\n"
+        f"{character_details(character_data)}\nOutline:\n{plan}\n"
+        f"Chapter heading: {chapter.get('heading', f'Chapter {index + 1}')}"
+    )
+
+
+def story_epilogue_prompt(character_data, outline):
+    plan = '; '.join(beat.get('beat', '') for beat in outline['chapters'])
+    return (
+        f"Write a brief epilogue for the story \"{outline.get('title', '')}\". The chapters cover: {plan}\n"
+        f"{character_details(character_data)}"
+    )
+
+
+async def stream_single_story(character_data, use_cache=True, seed=None):
+    parser = JsonStreamParser()
+    prompt = character_story_prompt(character_data)
+    async for chunk in stream_content(prompt, mode='story', use_cache=use_cache, seed=seed):
+        for path, value in parser.feed(chunk):
+            if path == ('title',) or path == ('epilogue',):
+                yield (path[0], None, value)
+            elif len(path) == 2 and path[0] == 'chapters' and isinstance(value, dict):
+                yield ('chapter', path[1], value)
+
+
+async def stream_outlined_story(character_data, use_cache=True, seed=None):
+    # Outline first, then every chapter and the epilogue concurrently, so a long story
+    # takes about outline + slowest chapter instead of the sum of all chapters
+    response = await generate_content(
+        story_outline_prompt(character_data), mode='story_outline', count=STORY_CHAPTERS, use_cache=use_cache, seed=seed
+    )
+    outline = parse_json_response(response.text)
+    if not isinstance(outline, dict) or not outline.get('chapters'):
+        raise ValueError("Invalid story outline")
+    beats = [beat if isinstance(beat, dict) else {"heading": str(beat)} for beat in outline['chapters']]
+    outline['chapters'] = beats
+
+    yield ('title', None, outline.get('title', 'Story'))
+    yield ('outline', None, [beat.get('heading', f'Chapter {i + 1}') for i, beat in enumerate(beats)])
+
+    async def write_chapter(index):
+        fallback = {"heading": beats[index].get('heading', f'Chapter {index + 1}'), "content": beats[index].get('beat', '')}
+        try:
+            prompt = story_chapter_prompt(character_data, outline, index)
+            response = await generate_content(prompt, mode='story_chapter', use_cache=use_cache, seed=seed)
+            chapter = parse_json_response(response.text)
+            if not isinstance(chapter, dict) or 'content' not in chapter:
+                raise ValueError("Invalid chapter format")
+            return ('chapter', index, {"heading": chapter.get('heading') or fallback['heading'], "content": chapter['content']})
+        except Exception as e:
+            logger.warning('Error writing chapter %d: %s', index + 1, e)
+            return ('chapter', index, fallback)
+
+    async def write_epilogue():
+        try:
+            response = await generate_content(
+                story_epilogue_prompt(character_data, outline), mode='story_epilogue', use_cache=use_cache, seed=seed
+            )
+            return ('epilogue', None, parse_json_response(response.text)['epilogue'])
+        except Exception as e:
+            logger.warning('Error writing epilogue: %s', e)
+            return ('epilogue', None, "To be continued...")
+
+    tasks = [asyncio.create_task(write_chapter(index)) for index in range(len(beats))]
+    tasks.append(asyncio.create_task(write_epilogue()))
     try:
-        
-        story_prompt = f"""Create an engaging short story about this character:
-        Name: {character_data.get('full_name', 'Unknown')}
-        Occupation: {character_data.get('occupation', 'Unknown')}
-        {'Title: ' + character_data['title'] if 'title' in character_data else ''}
-        {'Origin: ' + character_data['origin'] if 'origin' in character_data else ''}
-        {'Backstory: ' + character_data['backstory'] if 'backstory' in character_data else ''}
-        
-        Include:
-        - A day in their life
-        - A significant event
-        - Their hopes and dreams
-        - Their challenges
-        
-        Make it engaging and creative while staying true to their background.
-        Return the story in this JSON format:
-        {{
-            "title": "story title",
-            "chapters": [
-                {{
-                    "heading": "chapter name",
-                    "content": "chapter text"
-                }}
-            ],
-            "epilogue": "brief conclusion"
-        }}"""
-
-        response = model.generate_content(story_prompt)
-        
-        
-        response_text = response.text.strip()
-        if '```' in response_text:
-            response_text = response_text.split('```')[1].strip()
-            if response_text.startswith('json'):
-                response_text = response_text[4:].strip()
-        response_text = response_text.replace('```', '').strip()
-        
-        story_data = json.loads(response_text)
-        
-        
-        if not all(key in story_data for key in ['title', 'chapters', 'epilogue']):
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_character_story(character_data, use_cache=True, seed=None):
+    # Yields ('title', None, text), ('chapter', index, chapter) and ('epilogue', None, text)
+    # as each part of the story completes; the outline pipeline also yields
+    # ('outline', None, headings) before any chapter. Parts the model fails to deliver
+    # are filled in with a simple fallback so the story always ends up complete.
+    delivered = set()
+    started = time.perf_counter()
+    try:
+        if STORY_PIPELINE == 'outline':
+            parts = stream_outlined_story(character_data, use_cache=use_cache, seed=seed)
+        else:
+            parts = stream_single_story(character_data, use_cache=use_cache, seed=seed)
+        async for kind, index, value in parts:
+            delivered.add(kind)
+            yield (kind, index, value)
+
+        if not {'title', 'chapter', 'epilogue'} <= delivered:
             raise ValueError("Invalid story format")
-            
-        return story_data
 
     except Exception as e:
-        print(f"Error generating story: {str(e)}")
-        ui.notify(f'Error generating story: {str(e)}', type='error')
-        return {
-            "title": "A Simple Tale",
-            "chapters": [{
-                "heading": "Chapter 1",
-                "content": f"A story about {character_data.get('full_name', 'someone special')}..."
-            }],
-            "epilogue": "To be continued..."
-        }
+        logger.error('Error generating story: %s', e)
+        notify(f'Error generating story: {str(e)}', type='error')
+
+    if 'title' not in delivered:
+        yield ('title', None, "A Simple Tale")
+    if 'chapter' not in delivered:
+        yield ('chapter', 0, {
+            "heading": "Chapter 1",
+            "content": f"A story about {character_data.get('full_name', 'someone special')}..."
+        })
+    if 'epilogue' not in delivered:
+        yield ('epilogue', None, "To be continued...")
+    metrics.observe('generation_seconds', time.perf_counter() - started, mode='story')
+
+
+async def generate_character_story(character_data, use_cache=True, seed=None):
+    story_data = {"title": None, "chapters": {}, "epilogue": None}
+    async for kind, index, value in stream_character_story(character_data, use_cache=use_cache, seed=seed):
+        if kind == 'chapter':
+            story_data['chapters'][index] = value
+        elif kind != 'outline':
+            story_data[kind] = value
+    story_data['chapters'] = [story_data['chapters'][index] for index in sorted(story_data['chapters'])]
+    return story_data
+
+
+def fake_data_prompt(count):
+    return (
+        f"Generate {count} realistic fictional people. Every name, email, address, phone number and occupation "
+        "must be different."
+    )
+
+
+def names_prompt(count):
+    return f"Generate {count} realistic fictional people, giving only a full name and an occupation. Every name must be different."
 
 
-def generate_fake_data(count=1):
+async def generate_fake_data(count=1, shard=0, use_cache=True, seed=None):
+    if REGULAR_GENERATOR != 'model':
+        return await generate_batch('regular', count, use_cache=use_cache, shard_offset=shard, seed=seed)
     try:
-        
-        prompt = f"""Generate exactly {count} different fake persons. Each person must have completely different details.
-        Return a JSON object with an array of {count} people.
-        
-        Requirements:
-        - Generate EXACTLY {count} unique people
-        - Each person must have different names, emails, addresses, and occupations
-        - Return ONLY valid JSON with no additional text
-        - Do not include any markdown formatting
-        
-        Required JSON format:
-        {{
-            "people": [
-                {{
-                    "full_name": "(unique full name)",
-                    "email": "(unique email)",
-                    "address": "(unique address)",
-                    "phone_number": "(unique phone)",
-                    "occupation": "(unique occupation)"
-                }}
-                // Repeat for exactly {count} people with different details
-            ]
-        }}"""
-        
-        print(f"Sending request to Gemini API for {count} entries...")
-        response = model.generate_content(prompt)
-        print(f"Received response: {response.text}")
-        
-        try:
-            response_text = response.text.strip()
-            
-           
-            if '```' in response_text:
-                response_text = response_text.split('```')[1]
-                if '\n' in response_text:
-                    response_text = response_text.split('\n', 1)[1]
-            
-            response_text = response_text.replace('```', '').strip()
-            data = json.loads(response_text)
-            
-            
-            if isinstance(data, dict) and 'people' in data:
-                if len(data['people']) != count:
-                    print(f"Warning: Received {len(data['people'])} entries instead of {count}")
-                    if len(data['people']) < count:
-                        return generate_fake_data(count)
-                return data
-            elif isinstance(data, list):
-                return {"people": data}
-            else:
-                return {"people": [data]}
-                
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {str(e)}")
-            ui.notify(f'Error: Invalid JSON response from API: {str(e)}', type='error')
-            return None
-            
+        people = []
+        seen = {}
+        # Valid people from a short, truncated or partly invalid answer are kept; each retry
+        # asks only for the missing ones and names the people already generated
+        for attempt in range(MODEL_MAX_RETRIES + 1):
+            missing = count - len(people)
+            logger.debug('Requesting %d entries', missing)
+            prompt = build_people_prompt('regular', missing, exclude=seen)
+            response = await generate_content(
+                prompt, mode='regular', count=missing, shard=shard + attempt if seed is not None else shard,
+                use_cache=use_cache and not attempt, seed=seed
+            )
+            data = process_response(response)
+            for person in (data or {}).get('people', []):
+                key = person_key(person)
+                if key not in seen:
+                    seen[key] = None
+                    people.append(person)
+            if len(people) >= count:
+                break
+            logger.warning('Have %d entries of %d', len(people), count)
+            if attempt < MODEL_MAX_RETRIES:
+                metrics.inc('retries_total', mode='regular')
+        return {"people": people[:count]} if people else None
+
     except Exception as e:
-        print(f"General error: {str(e)}")
-        ui.notify(f'Error generating data: {str(e)}', type='error')
+        logger.error('Error generating data: %s', e)
+        notify(f'Error generating data: {str(e)}', type='error')
         return None
 
 
-async def generate_data():
+def exclusion_clause(exclude):
+    # exclude holds person_key() tuples; only the most recent few are spelled out
+    keys = list(exclude)[-TOPUP_EXCLUDE_LIMIT:]
+    if not keys:
+        return ''
+    listed = '; '.join(f'{name} <{email}>' if email else name for name, email in keys)
+    return f" Do not reuse any of these names or emails: {listed}."
+
+
+def custom_data_prompt(count, schema):
+    return f"Generate {count} {schema.description}. Every record must be different."
+
+
+def build_people_prompt(mode, count, fantasy_type='Time Travel', subtype='Medieval (500 - 1500)', exclude=()):
+    if mode == 'fantasy':
+        prompt = fantasy_data_prompt(count, fantasy_type, subtype)
+    elif mode == 'surprise':
+        prompt = surprise_data_prompt(count)
+    elif mode == 'regular_names':
+        prompt = names_prompt(count)
+    elif mode == 'regular':
+        prompt = fake_data_prompt(count)
+    else:
+        prompt = custom_data_prompt(count, RECORD_SCHEMAS[mode])
+    return f'{prompt} {RECORD_SCHEMAS[mode].prompt_fragment}{exclusion_clause(exclude)}'
+
+
+async def stream_people(mode='regular', count=1, shard=0, use_cache=True, seed=None, **prompt_kwargs):
+    # Yields each person as soon as its closing brace arrives from the model
+    if mode == 'regular' and REGULAR_GENERATOR == 'hybrid':
+        # The model only writes names and occupations; contact details are filled in locally
+        rng = local_generator.rng(shard, seed)
+        async for person in stream_people('regular_names', count, shard, use_cache, seed, **prompt_kwargs):
+            yield local_generator.fill(rng, [str(person.get('full_name', ''))], [person.get('occupation', '')])[0]
+        return
+    prompt = build_people_prompt(mode, count, **prompt_kwargs)
+    parser = JsonStreamParser()
+    received = 0
+    async for chunk in stream_content(prompt, mode=mode, count=count, shard=shard, use_cache=use_cache, seed=seed):
+        for path, value in parser.feed(chunk):
+            if is_person_event(path, value):
+                received += 1
+                for person in validate_records(mode, [value]):
+                    yield person
+
+    # A bare person object has no list around it, so it only shows up as the root
+    if not received and parser.done:
+        for person in validate_records(mode, normalize_people(parser.parse_root())['people']):
+            yield person
+
+
+def person_key(person):
+    key = (
+        str(person.get('full_name', '')).strip().lower(),
+        str(person.get('email', '')).strip().lower()
+    )
+    # Custom records may have neither field, so the whole record identifies them
+    return key if any(key) else (json.dumps(person, sort_keys=True), '')
+
+
+async def stream_batch(mode='regular', count=1, shard_size=SHARD_SIZE, use_cache=True, shard_offset=0, seen=None,
+                       seed=None, **prompt_kwargs):
+    # Fan the request out as concurrent shards and yield unique people as any shard produces them.
+    # Each shard gets its own index so cached shards of equal size stay distinct; callers that
+    # resume a run pass the next unused shard index and the keys of people already produced.
+    # A seeded batch holds each round back and yields it in shard order, so its output and
+    # de-duplication don't depend on which shard happened to finish first.
+    if mode == 'regular' and REGULAR_GENERATOR == 'local':
+        async for person in stream_local_batch(count, shard_offset, seen, seed):
+            yield person
+        return
+
+    seen = set() if seen is None else seen
+    # The people this batch produced last, in order; top-up prompts name these
+    recent = deque(maxlen=TOPUP_EXCLUDE_LIMIT)
+    produced = 0
+    started = time.perf_counter()
+
+    def admit(person):
+        nonlocal produced
+        key = person_key(person)
+        if produced >= count or key in seen:
+            return False
+        seen.add(key)
+        recent.append(key)
+        produced += 1
+        return True
+
+    for round_index in range(MAX_BATCH_ROUNDS):
+        remaining = count - produced
+        if remaining <= 0:
+            break
+        shards = [min(shard_size, remaining - start) for start in range(0, remaining, shard_size)]
+        if round_index:
+            metrics.inc('retries_total', len(shards), mode=mode)
+        queue = asyncio.Queue()
+
+        async def run_shard(index, size):
+            try:
+                async for person in stream_people(mode, size, shard=index, use_cache=use_cache, seed=seed, **prompt_kwargs):
+                    await queue.put((index, person))
+            except Exception as e:
+                logger.warning('Error generating shard %d: %s', index, e)
+            finally:
+                await queue.put((index, None))
+
+        if round_index:
+            # Top-up rounds ask only for what is still missing and name people already produced
+            prompt_kwargs['exclude'] = tuple(recent)
+        tasks = [asyncio.create_task(run_shard(shard_offset + i, size)) for i, size in enumerate(shards)]
+        shard_offset += len(shards)
+        pending = len(tasks)
+        held = {}
+        try:
+            while pending:
+                index, person = await queue.get()
+                if person is None:
+                    pending -= 1
+                elif seed is not None:
+                    held.setdefault(index, []).append(person)
+                elif admit(person):
+                    yield person
+        finally:
+            for task in tasks:
+                task.cancel()
+        for index in sorted(held):
+            for person in held[index]:
+                if admit(person):
+                    yield person
+
+    if produced < count:
+        logger.warning('Batch produced %d unique entries instead of %d', produced, count)
+    metrics.observe('generation_seconds', time.perf_counter() - started, mode=mode)
+
+
+async def stream_local_batch(count=1, shard_offset=0, seen=None, seed=None):
+    # Pure-local Regular mode has nothing to wait for, so each round is one local shard generated
+    # inline. It uses at most MAX_BATCH_ROUNDS shard indices, well inside what callers reserve.
+    # Nothing here awaits, so it hands the loop back every STREAM_YIELD_EVERY people.
+    seen = set() if seen is None else seen
+    produced = 0
+    started = time.perf_counter()
+    for round_index in range(MAX_BATCH_ROUNDS):
+        if produced >= count:
+            break
+        for person in local_generator.people(count - produced, shard_offset + round_index, seed):
+            key = person_key(person)
+            if key in seen:
+                continue
+            seen.add(key)
+            produced += 1
+            yield person
+            if produced % STREAM_YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    if produced < count:
+        logger.warning('Batch produced %d unique entries instead of %d', produced, count)
+    metrics.observe('generation_seconds', time.perf_counter() - started, mode='regular')
+
+
+async def generate_batch(mode='regular', count=1, shard_size=SHARD_SIZE, use_cache=True, **prompt_kwargs):
+    people = [person async for person in stream_batch(mode, count, shard_size, use_cache, **prompt_kwargs)]
+    return {"people": people} if people else None
+
+
+class WarmPool:
+    # Keeps pre-generated people per (mode, fantasy type, subtype) so clicks can be
+    # answered without a model round-trip. Pools refill in the background once they
+    # drop to the low-water mark, and people older than max_age are discarded.
+    def __init__(self, depth=WARM_POOL_DEPTH, low_water=WARM_POOL_LOW_WATER,
+                 refill_concurrency=WARM_POOL_REFILL_CONCURRENCY, max_age=WARM_POOL_MAX_AGE_SECONDS):
+        self.depth = depth
+        self.low_water = low_water
+        self.max_age = max_age
+        self.refill_semaphore = asyncio.Semaphore(refill_concurrency)
+        self.pools = {}
+        self.refilling = set()
+        self.tasks = set()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0}
+
+    @staticmethod
+    def prompt_kwargs_for(key):
+        pool_mode, fantasy_type, subtype = key
+        if pool_mode == 'fantasy':
+            return {'fantasy_type': fantasy_type, 'subtype': subtype}
+        return {}
+
+    def start(self):
+        if self.depth <= 0:
+            return
+        keys = [('regular', None, None), ('surprise', None, None)]
+        if WARM_POOL_FANTASY:
+            keys += [('fantasy', f_type, subtype) for f_type, subtypes in FANTASY_SUBTYPES.items() for subtype in subtypes]
+        for key in keys:
+            self.schedule_refill(key)
+
+    def take(self, key, count):
+        if self.depth <= 0:
+            return None
+        pool = self.pools.setdefault(key, deque())
+        now = time.time()
+        while pool and now - pool[0][0] > self.max_age:
+            pool.popleft()
+            self.stats['stale'] += 1
+
+        people = None
+        if len(pool) >= count:
+            people = [pool.popleft()[1] for _ in range(count)]
+            self.stats['hits'] += 1
+        else:
+            self.stats['misses'] += 1
+        self.schedule_refill(key)
+        return people
+
+    def schedule_refill(self, key):
+        pool = self.pools.setdefault(key, deque())
+        if len(pool) > self.low_water or key in self.refilling:
+            return
+        self.refilling.add(key)
+        task = asyncio.create_task(self.refill(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def refill(self, key):
+        pool = self.pools[key]
+        kwargs = self.prompt_kwargs_for(key)
+        try:
+            while len(pool) < self.depth:
+                async with self.refill_semaphore:
+                    data = await generate_batch(key[0], self.depth - len(pool), use_cache=False, **kwargs)
+                if not data:
+                    break
+                created_at = time.time()
+                pool.extend((created_at, person) for person in data['people'])
+        except Exception as e:
+            logger.error('Error refilling warm pool %s: %s', key, e)
+        finally:
+            self.refilling.discard(key)
+
+
+warm_pool = WarmPool()
+app.on_startup(warm_pool.start)
+
+
+def session_people(session, mode, **prompt_kwargs):
+    # A session with a seed reads (and fills) the dataset store; otherwise a batch is streamed
+    if session.seed is not None:
+        return decode_lines(seeded_lines(mode, session.num_entries, session.seed, fresh=session.fresh_results, **prompt_kwargs))
+    return stream_batch(mode, session.num_entries, use_cache=not session.fresh_results, **prompt_kwargs)
+
+
+async def generate_data(session, current_mode='Regular', f_type='Time Travel', subtype='Medieval (500 - 1500)'):
+    loop_watchdog.track('generate_data', current_mode)
     ui.notify('Generating data...', type='info')
+    session.touch()
     try:
-        
-        current_mode = mode.value if mode else 'Regular'
+        use_cache = not session.fresh_results
+        seeded = session.seed is not None
         data = None
         
         if current_mode == 'Regular':
-            data = generate_fake_data(count=num_entries)
+            people = None if seeded else warm_pool.take(('regular', None, None), session.num_entries)
+            if people:
+                data = {"people": people}
+                show_data_dialog(session, data, mode=current_mode)
+            else:
+                data = await stream_into_dialog(session, session_people(session, 'regular'), mode=current_mode)
         elif current_mode == 'Fantasy Mode':
-            f_type = fantasy_type_select.value if fantasy_type_select else 'Time Travel'
-            subtype = ''
-            if f_type == 'Time Travel':
-                subtype = era.value if era else 'Medieval (500 - 1500)'
-            elif f_type == 'Character Universe':
-                subtype = universe_type.value if universe_type else 'Magical Academy'
-            elif f_type == 'Alternate Reality':
-                subtype = reality_type.value if reality_type else 'Steampunk'
-            data = generate_fantasy_data(count=num_entries, fantasy_type=f_type, subtype=subtype)
+            use_pool = WARM_POOL_FANTASY and not seeded
+            people = warm_pool.take(('fantasy', f_type, subtype), session.num_entries) if use_pool else None
+            if people:
+                data = {"people": people}
+                show_data_dialog(session, data, mode=current_mode)
+            else:
+                data = await stream_into_dialog(
+                    session, session_people(session, 'fantasy', fantasy_type=f_type, subtype=subtype), mode=current_mode
+                )
+        elif current_mode in CUSTOM_SCHEMAS:
+            data = await stream_into_dialog(session, session_people(session, current_mode), mode=current_mode)
+        elif current_mode == 'Story Mode' and seeded:
+            events = decode_lines(seeded_lines('story', 1, session.seed, fresh=session.fresh_results))
+            person = await anext(events)
+            data = await stream_story_into_dialog(
+                session, {"people": [person['value']]}, ((e['event'], e['index'], e['value']) async for e in events)
+            )
         elif current_mode == 'Story Mode':
-            data = generate_fake_data(count=1)
+            people = warm_pool.take(('regular', None, None), 1)
+            data = {"people": people} if people else await generate_fake_data(count=1, use_cache=use_cache)
             if data:
-                story = generate_character_story(data['people'][0])
-                if story:
-                    data['story'] = story
+                data = await stream_story_into_dialog(
+                    session, data, stream_character_story(data['people'][0], use_cache=use_cache)
+                )
 
         if data:
-            show_data_dialog(data, mode=current_mode)
-            add_to_history(data)
+            await add_to_history(session, data, current_mode)
         else:
             ui.notify('Failed to generate data', type='error')
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.error('Error: %s', e)
         ui.notify(f'Error: {str(e)}', type='error')
 
+def surprise_data_prompt(count):
+    return (
+        f"Generate {count} creative, unusual but realistic fictional people: rare real occupations "
+        "(e.g. Professional Panda Nanny), quirky valid emails, real but uncommon places and plausible phone numbers. "
+        "Every person must be different."
+    )
 
-async def export_to_json():
-    data = generate_fake_data(count=num_entries)
-    if data:
-        try:
-            with open('fake_data.json', 'w') as json_file:
-                json.dump(data, json_file, indent=4)
-            ui.notify('Data exported to fake_data.json')
-        except Exception as e:
-            ui.notify(f'Error exporting data: {str(e)}')
-    else:
-        ui.notify('No data to export')
+
+def salvage_people(text):
+    # Complete person objects from a response that was cut off or broken further on
+    try:
+        return [value for path, value in JsonStreamParser().feed(text) if is_person_event(path, value)]
+    except ValueError:
+        return []
 
 
-def generate_surprise_data(count=1):
+def process_response(response, mode='regular'):
     try:
-        
-        prompt = f"""Generate {count} CREATIVE and UNUSUAL (but realistic) fake person(s).
-        Return ONLY a valid JSON object with no additional text or formatting.
-        Make the data interesting and unique, including:
-        - Unusual but real occupations (e.g., "Professional Panda Nanny", "Ethical Hacker")
-        - Quirky but valid email addresses
-        - Real but uncommon locations
-        - Interesting but possible phone numbers
-
-        IMPORTANT: Return EXACTLY this JSON format with no extra text:
-        {{
-            "people": [
-                {{
-                    "full_name": "unique name",
-                    "email": "valid.email@example.com",
-                    "address": "real address format",
-                    "phone_number": "valid phone",
-                    "occupation": "unusual occupation"
-                }}
-            ]
-        }}
-
-        Make sure:
-        1. All JSON is properly formatted with correct commas and brackets
-        2. All strings are in double quotes
-        3. No trailing commas
-        4. No comments or additional text"""
-        
-        print("Generating surprise data...")
-        response = model.generate_content(prompt)
-        print(f"Raw response: {response.text}")  
-        
-       
-        response_text = response.text.strip()
-        
-        
-        if '```' in response_text:
-            parts = response_text.split('```')
-            for part in parts:
-                if '{' in part and '}' in part:
-                    response_text = part.strip()
-                    break
-           
-            if response_text.startswith('json'):
-                response_text = response_text[4:].strip()
-        
-       
-        response_text = response_text.strip('`').strip()
-        print(f"Cleaned JSON string: {response_text}")  
-        
-        
-        data = json.loads(response_text)
-        
-        
-        if not isinstance(data, dict) or 'people' not in data or not isinstance(data['people'], list):
-            raise ValueError("Invalid response format")
-        
-        return data
-            
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {str(e)}")
-        print(f"Problematic JSON string: {response_text}")  # Debug log
-        ui.notify('Error: Invalid response format. Please try again.', type='error')
-        return None
-    except Exception as e:
-        print(f"Error generating surprise data: {str(e)}")
-        ui.notify(f'Error generating surprise data: {str(e)}', type='error')
+        data = normalize_people(parse_json_response(response.text))
+        return {**data, "people": validate_records(mode, data['people'])}
+    except ValueError as e:
+        people = salvage_people(response.text)
+        if people:
+            logger.warning('Salvaged %d people from a malformed response: %s', len(people), e)
+            metrics.inc('salvaged_people_total', len(people))
+            return {"people": validate_records(mode, people)}
+        logger.error('JSON decode error: %s', e)
+        notify(f'Error: Invalid JSON response from API: {str(e)}', type='error')
         return None
 
 
-def process_response(response):
-    try:
-        response_text = response.text.strip()
-        
-       
-        if '```' in response_text:
-            response_text = response_text.split('```')[1]
-            if '\n' in response_text:
-                response_text = response_text.split('\n', 1)[1]
-        
-        response_text = response_text.replace('```', '').strip()
-        data = json.loads(response_text)
-        
-      
-        if isinstance(data, dict) and 'people' in data:
-            return data
-        elif isinstance(data, list):
-            return {"people": data}
+class EntryStore:
+    # History and favorites live in SQLite (WAL) rather than RAM. Pages come from the
+    # (session, kind, created_at) indexes and search from an FTS5 table sharing row ids.
+    # The database is opened on first use, so headless commands never create it.
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.db_path = db_path
+        self.db = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_by_time ON entries (session_id, kind, created_at);
+                CREATE INDEX IF NOT EXISTS entries_by_mode ON entries (session_id, kind, mode, created_at);
+                CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(names, occupations, backstories);
+            """)
+        return self.db
+
+    @staticmethod
+    def search_columns(data):
+        people = data.get('people', [data])
+        names = ' '.join(str(person.get('full_name', '')) for person in people)
+        occupations = ' '.join(f"{person.get('occupation', '')} {person.get('title', '')}" for person in people)
+        texts = [str(person.get('backstory', '')) for person in people]
+        story = data.get('story')
+        if story:
+            texts += [story.get('title') or '', story.get('epilogue') or '']
+            texts += [chapter.get('content', '') for chapter in story.get('chapters', [])]
+        return names, occupations, ' '.join(texts)
+
+    @staticmethod
+    def match_query(text):
+        # Every word must match as a prefix; quoting keeps FTS syntax out of user input
+        return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+    def insert_rows(self, session_id, kind, mode, records):
+        with self.lock:
+            db = self.connect()
+            created_at = time.time()
+            for record in records:
+                cursor = db.execute(
+                    'INSERT INTO entries (session_id, kind, mode, created_at, data) VALUES (?, ?, ?, ?, ?)',
+                    (session_id, kind, mode, created_at, json.dumps(record))
+                )
+                db.execute(
+                    'INSERT INTO entries_fts (rowid, names, occupations, backstories) VALUES (?, ?, ?, ?)',
+                    (cursor.lastrowid, *self.search_columns(record))
+                )
+            db.commit()
+
+    def select_page(self, session_id, kind, offset, limit, newest_first=True, mode=None, query=None):
+        where = 'e.session_id = ? AND e.kind = ?'
+        params = [session_id, kind]
+        if mode:
+            where += ' AND e.mode = ?'
+            params.append(mode)
+        if query and self.match_query(query):
+            where += ' AND e.id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)'
+            params.append(self.match_query(query))
+        order = 'DESC' if newest_first else 'ASC'
+        with self.lock:
+            db = self.connect()
+            total = db.execute(f'SELECT COUNT(*) FROM entries e WHERE {where}', params).fetchone()[0]
+            rows = db.execute(
+                f'SELECT e.id, e.mode, e.created_at, e.data FROM entries e WHERE {where} '
+                f'ORDER BY e.created_at {order}, e.id {order} LIMIT ? OFFSET ?',
+                params + [limit, offset]
+            ).fetchall()
+        return [
+            {'id': row[0], 'mode': row[1], 'created_at': row[2], 'data': json.loads(row[3])} for row in rows
+        ], total
+
+    def delete_rows(self, session_id, kind, entry_id=None):
+        where = 'session_id = ? AND kind = ?' + (' AND id = ?' if entry_id is not None else '')
+        params = [session_id, kind] + ([entry_id] if entry_id is not None else [])
+        with self.lock:
+            db = self.connect()
+            db.execute(f'DELETE FROM entries_fts WHERE rowid IN (SELECT id FROM entries WHERE {where})', params)
+            db.execute(f'DELETE FROM entries WHERE {where}', params)
+            db.commit()
+
+    async def add(self, session_id, kind, mode, records):
+        await asyncio.to_thread(self.insert_rows, session_id, kind, mode, records)
+
+    async def page(self, session_id, kind, offset, limit, **filters):
+        return await asyncio.to_thread(self.select_page, session_id, kind, offset, limit, **filters)
+
+    async def delete(self, session_id, kind, entry_id=None):
+        await asyncio.to_thread(self.delete_rows, session_id, kind, entry_id)
+
+    async def all_data(self, session_id, kind):
+        rows, _ = await self.page(session_id, kind, 0, -1, newest_first=False)
+        return [row['data'] for row in rows]
+
+
+entry_store = EntryStore()
+
+
+class DatasetStore:
+    # Seeded generations saved as NDJSON files named by the SHA-256 of everything that decides
+    # their content, so repeating a request is a file read returning the first run's exact bytes.
+    def __init__(self, root=DATASET_DIR):
+        self.root = root
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0}
+
+    @staticmethod
+    def make_key(mode, count, seed, shard_size=SHARD_SIZE, chunk=None, **prompt_kwargs):
+        # chunk is how many entries each stream_batch call produced (the CLI's --checkpoint-every),
+        # since it decides the shard numbering and with it the data
+        recipe = {'mode': mode, 'count': count, 'seed': seed, 'prompt_version': PROMPT_VERSION, **prompt_kwargs}
+        if mode in CUSTOM_SCHEMAS:
+            recipe.update(schema=CUSTOM_SCHEMAS[mode].fields, description=CUSTOM_SCHEMAS[mode].description)
+        if mode == 'story':
+            recipe.update(pipeline=STORY_PIPELINE, chapters=STORY_CHAPTERS)
         else:
-            return {"people": [data]}
-            
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {str(e)}")
-        ui.notify(f'Error: Invalid JSON response from API: {str(e)}', type='error')
-        return None
+            recipe.update(shard_size=shard_size, chunk=min(chunk or count, count))
+        if mode in ('regular', 'story'):
+            recipe.update(generator=REGULAR_GENERATOR, locale=LOCAL_GENERATOR_LOCALE)
+        if not (mode == 'regular' and REGULAR_GENERATOR == 'local'):
+            recipe.update(backend=MODEL_BACKEND, model=GEMINI_MODEL)
+        return hashlib.sha256(json.dumps(recipe, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f'{key}.ndjson')
+
+    def read(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return data
+
+    def write(self, key, data=None, source=None):
+        # From bytes or a copy of a finished file, written to a temporary file and renamed
+        # so readers never see a partial dataset
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        if source is None:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+        else:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, path)
+        self.stats['writes'] += 1
+
+    async def get(self, key):
+        return await asyncio.to_thread(self.read, key)
+
+    async def put(self, key, data):
+        await asyncio.to_thread(self.write, key, data)
+
+
+dataset_store = DatasetStore()
+
+
+class SessionState:
+    # One browser's settings and last result; history and favorites live in entry_store.
+    # Each open tab registers its lists in views, so refreshing only touches that browser's pages.
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.num_entries = 1
+        self.fresh_results = False
+        self.seed = None
+        self.last_result = None
+        self.export_format = 'json'
+        self.compress_exports = False
+        self.views = {}
+        self.last_seen = time.time()
+
+    def touch(self):
+        self.last_seen = time.time()
+
+
+class SessionStore:
+    # Sessions keyed by browser id. Sessions with no open page are evicted once idle.
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS, sweep_interval=60):
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self.sessions = {}
+        self.tasks = set()
+        self.stats = {'created': 0, 'evicted': 0}
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = SessionState(session_id)
+            self.stats['created'] += 1
+        session.touch()
+        return session
+
+    def current(self):
+        # Falls back to one session per tab when no storage secret is configured
+        client = ui.context.client
+        try:
+            session_id = app.storage.browser['id']
+        except RuntimeError:
+            session_id = client.id
+        return self.get(session_id)
+
+    def attach(self, session, favorites_list, history_list):
+        client = ui.context.client
+        session.views[client.id] = (favorites_list, history_list)
 
+        def detach():
+            session.views.pop(client.id, None)
+            session.touch()
 
-def save_to_favorites(data):
-    global saved_favorites
-    saved_favorites.extend(data['people'])
+        client.on_delete(detach)
+
+    def evict_idle(self):
+        now = time.time()
+        for session_id, session in list(self.sessions.items()):
+            if not session.views and now - session.last_seen > self.idle_seconds:
+                del self.sessions[session_id]
+                self.stats['evicted'] += 1
+
+    def start(self):
+        task = asyncio.create_task(self.sweep())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.evict_idle()
+
+
+sessions = SessionStore()
+app.on_startup(sessions.start)
+
+
+async def save_to_favorites(session, data, mode='Regular'):
+    await entry_store.add(session.session_id, 'favorite', mode, data['people'])
     ui.notify('Added to favorites!', type='success')
-    refresh_containers()  
+    await refresh_containers(session)
 
-def remove_from_favorites(index):
-    global saved_favorites
-    saved_favorites.pop(index)
+async def remove_from_favorites(session, entry_id):
+    await entry_store.delete(session.session_id, 'favorite', entry_id)
     ui.notify('Removed from favorites', type='info')
-    refresh_containers()  
-
-def add_to_history(data):
-    global generation_history
-    generation_history.append({
-        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'data': data
-    })
-    if len(generation_history) > max_history_entries:
-        generation_history.pop(0)
-    refresh_containers()  
-
-def clear_history():
-    global generation_history
-    generation_history.clear()
+    await refresh_containers(session)
+
+async def add_to_history(session, data, mode='Regular'):
+    session.last_result = data
+    await entry_store.add(session.session_id, 'history', mode, [data])
+    await refresh_containers(session)
+
+async def clear_history(session):
+    await entry_store.delete(session.session_id, 'history')
     ui.notify('History cleared', type='info')
-    refresh_containers() 
+    await refresh_containers(session)
+
+
+class PagedList:
+    # Shows one page of stored entries. sync() diffs that page against the cards already
+    # on screen by row id, so an update only sends the cards that appeared, disappeared or moved.
+    def __init__(self, fetch_page, render_card, empty_text, page_size=LIST_PAGE_SIZE):
+        self.fetch_page = fetch_page
+        self.render_card = render_card
+        self.page_size = page_size
+        self.page = 0
+        self.cards = {}
+        self.empty_label = ui.label(empty_text).classes('text-center text-gray-500')
+        self.column = ui.column().classes('w-full gap-4')
+        with ui.row().classes('w-full justify-center items-center') as self.pager:
+            ui.button(icon='chevron_left', on_click=lambda: self.turn(-1)).props('flat')
+            self.page_label = ui.label()
+            ui.button(icon='chevron_right', on_click=lambda: self.turn(1)).props('flat')
+        self.pager.set_visibility(False)
+
+    async def turn(self, step):
+        self.page = max(self.page + step, 0)
+        await self.sync()
+
+    async def reset(self):
+        self.page = 0
+        await self.sync()
+
+    async def sync(self):
+        rows, total = await self.fetch_page(self.page * self.page_size, self.page_size)
+        pages = max(1, -(-total // self.page_size))
+        if self.page >= pages:
+            self.page = pages - 1
+            rows, total = await self.fetch_page(self.page * self.page_size, self.page_size)
+
+        visible = {row['id'] for row in rows}
+        for entry_id in [entry_id for entry_id in self.cards if entry_id not in visible]:
+            self.cards.pop(entry_id).delete()
+
+        for position, row in enumerate(rows):
+            card = self.cards.get(row['id'])
+            if card is None:
+                with self.column:
+                    with ui.card().classes('w-full') as card:
+                        self.render_card(row)
+                self.cards[row['id']] = card
+            if self.column.default_slot.children.index(card) != position:
+                card.move(target_index=position)
+
+        self.empty_label.set_visibility(not rows)
+        self.pager.set_visibility(pages > 1)
+        self.page_label.set_text(f'Page {self.page + 1} of {pages} ({total} entries)')
+
+
+def record_title(person):
+    # Custom records may have no full_name, so their first text field stands in
+    return person.get('full_name') or next((value for value in person.values() if isinstance(value, str)), 'Record')
+
+
+def render_favorite(session, row):
+    person = row['data']
+    with ui.row().classes('w-full justify-between items-center'):
+        ui.label(record_title(person)).classes('text-h6')
+        ui.button(icon='delete', on_click=lambda: remove_from_favorites(session, row['id']))
+    for key, value in person.items():
+        ui.label(f"{key.replace('_', ' ').title()}: {value}")
+
+
+def render_history_entry(session, row, preview=5):
+    with ui.row().classes('w-full justify-between items-center'):
+        timestamp = datetime.fromtimestamp(row['created_at']).strftime("%Y-%m-%d %H:%M:%S")
+        ui.label(f"Generated on: {timestamp}").classes('text-h6')
+        ui.button(
+            icon='download',
+            on_click=lambda: export_data(
+                row['data'], session.export_format, name='history', compress=session.compress_exports
+            )
+        ).tooltip('Export this entry')
+    ui.label(row['mode']).classes('text-gray-500')
+    people = row['data']['people']
+    for person in people[:preview]:
+        ui.label(f"Name: {record_title(person)}")
+    if len(people) > preview:
+        ui.label(f'... and {len(people) - preview} more').classes('text-gray-500')
+    ui.separator()
+
+
+async def refresh_containers(session):
+    for favorites_list, history_list in list(session.views.values()):
+        await favorites_list.sync()
+        await history_list.sync()
+
+
+def export_rows(data):
+    # One row per person; a Story payload's story rides along on its character's row
+    for i, person in enumerate(data.get('people', [])):
+        if i == 0 and data.get('story'):
+            person = {**person, 'story_title': data['story'].get('title'), 'story': data['story']}
+        yield person
+
+
+def flatten_record(record):
+    # Lists and nested objects become JSON text so every value fits a CSV cell or SQL column
+    return {key: json.dumps(value) if isinstance(value, (list, dict)) else value for key, value in record.items()}
+
+
+def peek_fieldnames(records, fieldnames=None):
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        return fieldnames or [], iter(())
+    return fieldnames or list(first), itertools.chain([first], records)
+
+
+def sql_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sql_literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Streaming writers: each consumes an iterator of person records, writes as it goes
+# and returns the number of rows written, so memory stays flat for any row count.
+
+def write_json(records, f, extra=None):
+    f.write('{"people": [')
+    count = 0
+    for record in records:
+        f.write(',\n' if count else '\n')
+        f.write(json.dumps(record))
+        count += 1
+    f.write('\n]')
+    for key, value in (extra or {}).items():
+        f.write(f',\n{json.dumps(key)}: {json.dumps(value)}')
+    f.write('}\n')
+    return count
+
+
+def write_jsonl(records, f):
+    count = 0
+    for record in records:
+        f.write(json.dumps(record))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def write_csv(records, f, fieldnames=None):
+    fieldnames, records = peek_fieldnames(records, fieldnames)
+    writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(flatten_record(record))
+        count += 1
+    return count
+
+
+def write_sql(records, f, fieldnames=None, table='people', chunk_rows=SQL_INSERT_CHUNK_ROWS):
+    fieldnames, records = peek_fieldnames(records, fieldnames)
+    if not fieldnames:
+        return 0
+    f.write(f"CREATE TABLE IF NOT EXISTS {sql_identifier(table)} (\n")
+    # Records that bring their own id keep it; the rest get a generated key column
+    if 'id' not in fieldnames:
+        f.write("    id INTEGER PRIMARY KEY AUTOINCREMENT,\n")
+    f.write(",\n".join(f"    {sql_identifier(field)} TEXT" for field in fieldnames))
+    f.write("\n);\n")
+
+    insert = f"\nINSERT INTO {sql_identifier(table)} ({', '.join(sql_identifier(field) for field in fieldnames)}) VALUES\n"
+    count = 0
+    for record in records:
+        record = flatten_record(record)
+        if count % chunk_rows == 0:
+            f.write((";\n" if count else "") + insert)
+        else:
+            f.write(",\n")
+        f.write('(' + ', '.join(sql_literal(record.get(field)) for field in fieldnames) + ')')
+        count += 1
+    if count:
+        f.write(";\n")
+    return count
 
 
-def refresh_containers():
-    if favorites_container:
-        favorites_container.clear()
-        with favorites_container:
-            with ui.scroll_area().classes('w-full h-96'):
-                with ui.column().classes('w-full gap-4 p-4'):
-                    if not saved_favorites:
-                        ui.label('No favorites yet').classes('text-center text-gray-500')
-                    for i, person in enumerate(saved_favorites):
-                        with ui.card().classes('w-full'):
-                            with ui.row().classes('w-full justify-between items-center'):
-                                ui.label(f"Person {i+1}").classes('text-h6')
-                                ui.button(icon='delete', on_click=lambda i=i: remove_from_favorites(i))
-                            for key, value in person.items():
-                                ui.label(f"{key.replace('_', ' ').title()}: {value}")
-
-    if history_container:
-        history_container.clear()
-        with history_container:
-            with ui.scroll_area().classes('w-full h-96'):
-                with ui.column().classes('w-full gap-4 p-4'):
-                    ui.button('Clear History', on_click=clear_history).classes('self-end')
-                    if not generation_history:
-                        ui.label('No history yet').classes('text-center text-gray-500')
-                    for entry in reversed(generation_history):
-                        with ui.card().classes('w-full'):
-                            ui.label(f"Generated on: {entry['timestamp']}").classes('text-h6')
-                            for person in entry['data']['people']:
-                                ui.label(f"Name: {person['full_name']}")
-                            ui.separator()
-
-async def export_data(format_type='json'):
-    data = generate_fake_data(count=num_entries)
-    if data:
-        try:
-            filename = f'fake_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            if format_type == 'json':
-                with open(f'{filename}.json', 'w') as f:
-                    json.dump(data, f, indent=4)
-            elif format_type == 'csv':
-                with open(f'{filename}.csv', 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=data['people'][0].keys())
-                    writer.writeheader()
-                    writer.writerows(data['people'])
-            elif format_type == 'sql':
-                with open(f'{filename}.sql', 'w') as f:
-                    f.write("CREATE TABLE IF NOT EXISTS people (\n")
-                    f.write("    id INTEGER PRIMARY KEY AUTOINCREMENT,\n")
-                    f.write("    full_name TEXT,\n")
-                    f.write("    email TEXT,\n")
-                    f.write("    address TEXT,\n")
-                    f.write("    phone_number TEXT,\n")
-                    f.write("    occupation TEXT\n")
-                    f.write(");\n\n")
-                    
-                    f.write("INSERT INTO people (full_name, email, address, phone_number, occupation) VALUES\n")
-                    values = []
-                    for person in data['people']:
-                        values.append(f"('{person['full_name']}', '{person['email']}', '{person['address']}', '{person['phone_number']}', '{person['occupation']}')")
-                    f.write(",\n".join(values) + ";")
-            ui.notify(f'Data exported as {format_type.upper()} to {filename}.{format_type}', type='success')
-        except Exception as e:
-            ui.notify(f'Error exporting data: {str(e)}', type='error')
+EXPORT_WRITERS = {'json': write_json, 'jsonl': write_jsonl, 'csv': write_csv, 'sql': write_sql}
+
 
-async def generate_surprise():
+def write_export(records, path, format_type='jsonl', compress=False, **options):
+    writer = EXPORT_WRITERS[format_type]
+    if compress:
+        with gzip.open(path, 'wt', newline='', compresslevel=6) as f:
+            return writer(records, f, **options)
+    with open(path, 'w', newline='') as f:
+        return writer(records, f, **options)
+
+
+async def export_data(data, format_type='json', name='fake_data', compress=False):
+    # Exports exactly what the user selected; no model calls are made here
+    if not data or not data.get('people'):
+        ui.notify('Nothing to export yet', type='warning')
+        return
+    try:
+        path = f'{name}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{format_type}' + ('.gz' if compress else '')
+        started = time.perf_counter()
+        if format_type == 'json':
+            extra = {key: value for key, value in data.items() if key != 'people'}
+            rows = await asyncio.to_thread(write_export, data['people'], path, 'json', compress, extra=extra)
+        elif format_type == 'jsonl':
+            rows = await asyncio.to_thread(write_export, export_rows(data), path, 'jsonl', compress)
+        else:
+            fieldnames = list(dict.fromkeys(key for row in export_rows(data) for key in row))
+            rows = await asyncio.to_thread(write_export, export_rows(data), path, format_type, compress, fieldnames=fieldnames)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        ui.notify(f'Exported {rows} rows as {format_type.upper()} to {path} ({rows / elapsed:,.0f} rows/s)', type='success')
+    except Exception as e:
+        ui.notify(f'Error exporting data: {str(e)}', type='error')
+
+
+async def generate_surprise(session):
+    loop_watchdog.track('generate_surprise', 'Surprise')
     ui.notify('Generating surprising data...', type='info')
+    session.touch()
     try:
-        data = generate_surprise_data(count=num_entries)
+        people = warm_pool.take(('surprise', None, None), session.num_entries) if session.seed is None else None
+        if people:
+            data = {"people": people}
+            show_data_dialog(session, data, mode='Surprise')
+        else:
+            data = await stream_into_dialog(session, session_people(session, 'surprise'), mode='Surprise')
         if data and data.get('people'):
-            with ui.dialog() as dialog, ui.card().classes('w-96 dialog-content'):
-               
-                with ui.row().classes('w-full justify-between items-center mb-4'):
-                    ui.label('🎲 Surprise Data Generated!').classes('text-h6')
-                    ui.button(icon='favorite', on_click=lambda: save_to_favorites(data)).classes(
-                        'text-red-500 bg-transparent hover:bg-red-50'
-                    ).tooltip('Add to Favorites')
-
-                with ui.column().classes('max-h-96 overflow-auto'):
-                    for i, person in enumerate(data.get('people', [])):
-                        ui.label(f"Person {i+1}:").classes('text-h6 mt-4')
-                        ui.label(f"Name: {person.get('full_name')}").classes('mt-2')
-                        ui.label(f"Email: {person.get('email')}").classes('mt-2')
-                        ui.label(f"Address: {person.get('address')}").classes('mt-2')
-                        ui.label(f"Phone: {person.get('phone_number')}").classes('mt-2')
-                        ui.label(f"Occupation: {person.get('occupation')}").classes('mt-2')
-                        if i < len(data.get('people')) - 1:
-                            ui.separator().classes('my-4')
-                
-                
-                with ui.row().classes('w-full justify-between mt-4'):
-                    ui.button('Close', on_click=dialog.close)
-                    ui.button(
-                        'Add to Favorites', 
-                        on_click=lambda: [save_to_favorites(data), dialog.close()]
-                    ).classes('bg-red-600')
-                dialog.open()
-                
-                add_to_history(data)
+            await add_to_history(session, data, 'Surprise')
         else:
             ui.notify('Failed to generate surprise data', type='error')
     except Exception as e:
-        print(f"Error in generate_surprise: {str(e)}")
+        logger.error('Error in generate_surprise: %s', e)
         ui.notify(f'Error: {str(e)}', type='error')
 
 
+api_requests_in_flight = 0
+
+
+def ndjson_line(value):
+    return (json.dumps(value) + '\n').encode('utf-8')
+
+
+async def api_people(mode, count, use_cache, **prompt_kwargs):
+    pool_key = (mode, prompt_kwargs.get('fantasy_type'), prompt_kwargs.get('subtype'))
+    people = warm_pool.take(pool_key, count) if use_cache and (mode != 'fantasy' or WARM_POOL_FANTASY) else None
+    if people:
+        for person in people:
+            yield ndjson_line(person)
+        return
+    async for person in stream_batch(mode, count, use_cache=use_cache, **prompt_kwargs):
+        yield ndjson_line(person)
+
+
+async def api_story(use_cache, seed=None):
+    people = warm_pool.take(('regular', None, None), 1) if use_cache and seed is None else None
+    data = {"people": people} if people else await generate_fake_data(count=1, use_cache=use_cache, seed=seed)
+    if not data:
+        raise ValueError('Failed to generate a character')
+    yield ndjson_line({"event": "person", "index": None, "value": data['people'][0]})
+    async for kind, index, value in stream_character_story(data['people'][0], use_cache=use_cache, seed=seed):
+        yield ndjson_line({"event": kind, "index": index, "value": value})
+
+
+async def seeded_lines(mode, count, seed, fresh=False, **prompt_kwargs):
+    # NDJSON lines of a seeded generation, in the API's format. A stored dataset is replayed
+    # byte for byte; otherwise lines are passed on as they are generated and stored once complete.
+    count = 1 if mode == 'story' else count
+    key = DatasetStore.make_key(mode, count, seed, **prompt_kwargs)
+    data = None if fresh else await dataset_store.get(key)
+    if data is not None:
+        for line in data.splitlines(keepends=True):
+            yield line
+        return
+
+    if mode == 'story':
+        lines = api_story(False, seed)
+    else:
+        lines = api_people(mode, count, False, seed=seed, **prompt_kwargs)
+    produced = []
+    async for line in lines:
+        produced.append(line)
+        yield line
+    if mode == 'story' or len(produced) == count:
+        await dataset_store.put(key, b''.join(produced))
+    else:
+        logger.warning('Not storing seeded %s dataset: %d of %d entries', mode, len(produced), count)
+
+
+async def decode_lines(lines):
+    async for line in lines:
+        yield json.loads(line)
+
+
+async def api_stream(lines):
+    # Holds one request slot for as long as the client is reading the stream
+    global api_requests_in_flight
+    try:
+        async for line in lines:
+            yield line
+    except Exception as e:
+        logger.error('Error streaming API response: %s', e)
+        yield ndjson_line({"error": str(e)})
+    finally:
+        api_requests_in_flight -= 1
+
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/api/usage')
+async def api_usage():
+    # Token totals per mode since startup
+    return token_usage.modes
+
+
+@app.get('/api/generate/{generation_mode}')
+async def api_generate(
+    generation_mode: str,
+    count: int = Query(1, ge=1, le=MAX_BATCH_ENTRIES),
+    fantasy_type: str = Query('Time Travel', alias='type'),
+    subtype: str = None,
+    fresh: bool = False,
+    seed: int = None
+):
+    # Streams one JSON object per line: a record for regular, fantasy, surprise and custom schema modes,
+    # or a story event ({"event", "index", "value"}) for story. With a seed the result
+    # comes from (or is saved to) the dataset store; fresh then regenerates and replaces it.
+    global api_requests_in_flight
+    loop_watchdog.track('api_generate', generation_mode)
+    if generation_mode not in ('regular', 'fantasy', 'surprise', 'story', *CUSTOM_SCHEMAS):
+        raise HTTPException(status_code=404, detail=f'Unknown mode {generation_mode}')
+    if generation_mode == 'fantasy':
+        if fantasy_type not in FANTASY_SUBTYPES:
+            raise HTTPException(status_code=400, detail=f"type must be one of: {', '.join(FANTASY_SUBTYPES)}")
+        subtype = subtype or FANTASY_SUBTYPES[fantasy_type][0]
+        if subtype not in FANTASY_SUBTYPES[fantasy_type]:
+            raise HTTPException(
+                status_code=400, detail=f"subtype for {fantasy_type} must be one of: {', '.join(FANTASY_SUBTYPES[fantasy_type])}"
+            )
+    if api_requests_in_flight >= API_MAX_CONCURRENT_REQUESTS:
+        return JSONResponse({"detail": "Too many requests in progress"}, status_code=429, headers={"Retry-After": "1"})
+
+    prompt_kwargs = {'fantasy_type': fantasy_type, 'subtype': subtype} if generation_mode == 'fantasy' else {}
+    if seed is not None:
+        lines = seeded_lines(generation_mode, count, seed, fresh=fresh, **prompt_kwargs)
+    elif generation_mode == 'story':
+        lines = api_story(not fresh)
+    else:
+        lines = api_people(generation_mode, count, not fresh, **prompt_kwargs)
+    api_requests_in_flight += 1
+    return StreamingResponse(api_stream(lines), media_type='application/x-ndjson')
+
+
+def parse_generate_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='main.py generate',
+        description='Generate entries without starting the UI and write them to a JSONL, JSON, CSV or SQL file. '
+                    'An interrupted run resumes from its checkpoint when started again with the same arguments.'
+    )
+    parser.add_argument('--mode', choices=['regular', 'fantasy', 'surprise', *CUSTOM_SCHEMAS], default='regular')
+    parser.add_argument('--type', dest='fantasy_type', choices=list(FANTASY_SUBTYPES), default='Time Travel')
+    parser.add_argument('--subtype', default=None, help='Fantasy subtype, e.g. "Cyberpunk" (defaults to the first of the type)')
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--out', required=True, help='Output file')
+    parser.add_argument('--format', dest='format_type', choices=list(EXPORT_WRITERS), default='jsonl',
+                        help='Output format; anything but plain JSONL is written from a JSONL work file once the run is done')
+    parser.add_argument('--compress', action='store_true', help='Gzip the output file')
+    parser.add_argument('--generator', choices=['model', 'hybrid', 'local'], default=REGULAR_GENERATOR,
+                        help='Where regular mode fields come from; local makes no model calls')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser.add_argument('--concurrency', type=int, default=MAX_CONCURRENT_GENERATIONS, help='Model calls in flight at once')
+    parser.add_argument('--checkpoint-every', type=int, default=1000, help='Entries generated between checkpoints')
+    parser.add_argument('--use-cache', action='store_true', help='Allow cached responses instead of fresh generations')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Make the run reproducible; a finished seeded run is kept in the dataset store and reused')
+    parser.add_argument('--overwrite', action='store_true', help='Replace an existing output file that has no checkpoint')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'fantasy':
+        subtypes = FANTASY_SUBTYPES[args.fantasy_type]
+        args.subtype = args.subtype or subtypes[0]
+        if args.subtype not in subtypes:
+            parser.error(f"--subtype for {args.fantasy_type} must be one of: {', '.join(subtypes)}")
+    if args.count < 1 or args.shard_size < 1 or args.concurrency < 1 or args.checkpoint_every < 1:
+        parser.error('--count, --shard-size, --concurrency and --checkpoint-every must be positive')
+    return args
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def save_checkpoint(path, state):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
+async def run_generate_command(args):
+    global generation_limiter, REGULAR_GENERATOR
+    generation_limiter = AdaptiveConcurrency(args.concurrency)
+    REGULAR_GENERATOR = args.generator
+
+    params = {'mode': args.mode, 'fantasy_type': args.fantasy_type, 'subtype': args.subtype, 'count': args.count}
+    if args.mode == 'regular':
+        params['generator'] = args.generator
+    if args.seed is not None:
+        params.update(seed=args.seed, shard_size=args.shard_size, checkpoint_every=args.checkpoint_every)
+    prompt_kwargs = {'fantasy_type': args.fantasy_type, 'subtype': args.subtype} if args.mode == 'fantasy' else {}
+    checkpoint_path = f'{args.out}.checkpoint.json'
+    # Entries are always checkpointed as JSONL; other formats are streamed from this file once the run is done
+    converted = args.format_type != 'jsonl' or args.compress
+    work_path = f'{args.out}.partial.jsonl' if converted else args.out
+    state = {**params, 'written': 0, 'bytes': 0, 'next_shard': 0}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            saved = json.load(f)
+        if any(saved.get(key) != value for key, value in params.items()):
+            raise SystemExit(f'{checkpoint_path} belongs to a different run; delete it to start over')
+        state = saved
+        print(f"Resuming at {state['written']}/{args.count} entries")
+    elif os.path.exists(args.out) and os.path.getsize(args.out) and not args.overwrite:
+        raise SystemExit(f'{args.out} already exists; pass --overwrite to replace it')
+
+    dataset_key = None
+    if args.seed is not None:
+        dataset_key = DatasetStore.make_key(
+            args.mode, args.count, args.seed, shard_size=args.shard_size, chunk=args.checkpoint_every, **prompt_kwargs
+        )
+        if not state['written'] and os.path.exists(dataset_store.path(dataset_key)):
+            if converted:
+                write_export(read_jsonl(dataset_store.path(dataset_key)), args.out, args.format_type, args.compress)
+            else:
+                shutil.copyfile(dataset_store.path(dataset_key), args.out)
+            dataset_store.stats['hits'] += 1
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            print(f"Done: {args.count} entries copied from {dataset_store.path(dataset_key)} to {args.out}")
+            return
+
+    save_checkpoint(checkpoint_path, state)
+    seen = set()
+    with open(work_path, 'a+b') as f:
+        # Anything written after the last checkpoint is incomplete, so it is dropped and regenerated
+        f.truncate(state['bytes'])
+        f.seek(0)
+        for line in f:
+            seen.add(person_key(json.loads(line)))
+
+        started = time.perf_counter()
+        resumed_at = state['written']
+        while state['written'] < args.count:
+            chunk = min(args.checkpoint_every, args.count - state['written'])
+            produced = 0
+            async for person in stream_batch(
+                args.mode, chunk, shard_size=args.shard_size, use_cache=args.use_cache,
+                shard_offset=state['next_shard'], seen=seen, seed=args.seed, **prompt_kwargs
+            ):
+                f.write((json.dumps(person) + '\n').encode('utf-8'))
+                produced += 1
+            f.flush()
+            os.fsync(f.fileno())
+
+            # Reserve every shard index this chunk could have used, including top-up rounds
+            state['next_shard'] += MAX_BATCH_ROUNDS * -(-chunk // args.shard_size)
+            state['written'] += produced
+            state['bytes'] = f.tell()
+            save_checkpoint(checkpoint_path, state)
+
+            rate = (state['written'] - resumed_at) / max(time.perf_counter() - started, 1e-9)
+            print(f"{state['written']}/{args.count} entries written to {work_path} ({rate:,.1f} entries/s)")
+            if not produced:
+                raise SystemExit('The model returned no new entries; rerun the same command to resume')
+
+    if converted:
+        started = time.perf_counter()
+        rows = write_export(read_jsonl(work_path), args.out, args.format_type, args.compress)
+        print(f"Wrote {rows} rows to {args.out} ({rows / max(time.perf_counter() - started, 1e-9):,.0f} rows/s)")
+    os.remove(checkpoint_path)
+    print(f"Done: {state['written']} entries in {args.out}")
+    if dataset_key:
+        dataset_store.write(dataset_key, source=work_path)
+        print(f"Stored as {dataset_store.path(dataset_key)}")
+    if converted:
+        os.remove(work_path)
+    print(f"Tokens: {token_usage.summary()}")
+
+
 ui.page('/')(main_page)
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'generate':
+        try:
+            asyncio.run(run_generate_command(parse_generate_args(sys.argv[2:])))
+        except KeyboardInterrupt:
+            sys.exit('Interrupted; rerun the same command to resume from the last checkpoint')
+        sys.exit(0)
+
     port = int(os.environ.get('PORT', 8082))  
     ui.run(
         host='0.0.0.0',
         port=port,
         reload=False,
         title='Fake Frenzy',
+        storage_secret=STORAGE_SECRET,
         show=False,
         dark=False,
         tailwind=True
@@ -0,0 +1,24 @@
+import os
+import shutil
+import sys
+import tempfile
+
+# main reads its settings at import time, so the offline backend and throw-away stores are set up first
+WORK_DIR = tempfile.mkdtemp(prefix='fake_frenzy_tests_')
+os.environ.update({
+    'MODEL_BACKEND': 'fake',
+    'FAKE_MODEL_LATENCY': '0',
+    'FAKE_MODEL_FAILURE_RATE': '0',
+    'FAKE_MODEL_TRUNCATION_RATE': '0',
+    'FAKE_MODEL_INVALID_RATE': '0',
+    'WARM_POOL_DEPTH': '0',
+    'LOG_LEVEL': 'WARNING',
+    'HISTORY_DB_PATH': os.path.join(WORK_DIR, 'history.db'),
+    'DATASET_DIR': os.path.join(WORK_DIR, 'datasets'),
+})
+os.environ.pop('CACHE_DB_PATH', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
@@ -0,0 +1,76 @@
+import asyncio
+import os
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = main.DatasetStore(root=str(tmp_path / 'datasets'))
+    monkeypatch.setattr(main, 'dataset_store', store)
+    return store
+
+
+def test_key_covers_everything_that_decides_the_content(monkeypatch):
+    key = main.DatasetStore.make_key('regular', 10, 7)
+    assert key == main.DatasetStore.make_key('regular', 10, 7)
+    assert len({
+        key,
+        main.DatasetStore.make_key('regular', 10, 8),
+        main.DatasetStore.make_key('regular', 11, 7),
+        main.DatasetStore.make_key('surprise', 10, 7),
+        main.DatasetStore.make_key('regular', 10, 7, shard_size=5),
+        main.DatasetStore.make_key('regular', 10, 7, chunk=5),
+        main.DatasetStore.make_key('fantasy', 10, 7, fantasy_type='Time Travel', subtype='Cyberpunk'),
+    }) == 7
+    # A chunk larger than the run changes nothing
+    assert main.DatasetStore.make_key('regular', 10, 7, chunk=1000) == key
+
+    monkeypatch.setattr(main, 'MODEL_BACKEND', 'replay')
+    assert main.DatasetStore.make_key('regular', 10, 7) != key
+
+
+def test_local_keys_ignore_the_model(monkeypatch):
+    monkeypatch.setattr(main, 'REGULAR_GENERATOR', 'local')
+    key = main.DatasetStore.make_key('regular', 10, 7)
+    monkeypatch.setattr(main, 'MODEL_BACKEND', 'replay')
+    assert main.DatasetStore.make_key('regular', 10, 7) == key
+
+
+def test_read_and_write(store):
+    key = main.DatasetStore.make_key('regular', 2, 1)
+    assert store.read(key) is None
+    store.write(key, b'{"a": 1}\n')
+    assert store.path(key) == os.path.join(store.root, key[:2], f'{key}.ndjson')
+    assert os.listdir(os.path.dirname(store.path(key))) == [f'{key}.ndjson']
+    assert store.read(key) == b'{"a": 1}\n'
+    assert store.stats == {'hits': 1, 'misses': 1, 'writes': 1}
+
+
+def collect(lines):
+    async def run():
+        return [line async for line in lines]
+    return b''.join(asyncio.run(run()))
+
+
+def test_seeded_runs_are_stored_and_replayed(store, monkeypatch):
+    first = collect(main.seeded_lines('regular', 12, 42))
+    assert len(first.splitlines()) == 12
+    assert store.stats['writes'] == 1
+
+    def no_generation(*args, **kwargs):
+        raise AssertionError('a stored dataset should be replayed')
+
+    monkeypatch.setattr(main, 'api_people', no_generation)
+    assert collect(main.seeded_lines('regular', 12, 42)) == first
+    assert store.stats['hits'] == 1
+
+
+def test_fresh_runs_replace_the_stored_dataset(store):
+    key = main.DatasetStore.make_key('regular', 3, 5)
+    store.write(key, b'stale\n')
+    lines = collect(main.seeded_lines('regular', 3, 5, fresh=True))
+    assert store.read(key) == lines
+    assert len(lines.splitlines()) == 3
@@ -0,0 +1,64 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = main.EntryStore(db_path=str(tmp_path / 'history.db'))
+    # Separate inserts so every entry gets its own created_at
+    store.insert_rows('a', 'history', 'Regular', [{'people': [{'full_name': 'Ada Lovelace', 'occupation': 'Mathematician'}]}])
+    store.insert_rows('a', 'history', 'Fantasy Mode', [{'people': [
+        {'full_name': 'Lyra Vale', 'title': 'Storm Warden', 'backstory': 'Raised by lighthouse keepers.'}
+    ]}])
+    store.insert_rows('a', 'history', 'Story Mode', [{
+        'people': [{'full_name': 'Bram Stone', 'occupation': 'Baker'}],
+        'story': {'title': 'The Long Loaf', 'chapters': [{'heading': 'One', 'content': 'A sourdough starter escapes.'}]}
+    }])
+    store.insert_rows('a', 'favorite', 'Regular', [{'people': [{'full_name': 'Ada Byron', 'occupation': 'Poet'}]}])
+    store.insert_rows('b', 'history', 'Regular', [{'people': [{'full_name': 'Ada Smith', 'occupation': 'Pilot'}]}])
+    return store
+
+
+def names(rows):
+    return [row['data']['people'][0]['full_name'] for row in rows]
+
+
+def test_pages_are_per_session_and_kind(store):
+    rows, total = store.select_page('a', 'history', 0, 2)
+    assert total == 3
+    assert names(rows) == ['Bram Stone', 'Lyra Vale']
+    rows, _ = store.select_page('a', 'history', 2, 2)
+    assert names(rows) == ['Ada Lovelace']
+    rows, _ = store.select_page('a', 'history', 0, -1, newest_first=False)
+    assert names(rows) == ['Ada Lovelace', 'Lyra Vale', 'Bram Stone']
+    rows, total = store.select_page('a', 'history', 0, 10, mode='Fantasy Mode')
+    assert (names(rows), total) == (['Lyra Vale'], 1)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('ada', ['Ada Lovelace']),
+    ('lov math', ['Ada Lovelace']),
+    ('ada pilot', []),
+    ('warden', ['Lyra Vale']),
+    ('lighthouse', ['Lyra Vale']),
+    ('sourdough', ['Bram Stone']),
+    ('ada" (* -', ['Ada Lovelace']),
+    ('  ', ['Bram Stone', 'Lyra Vale', 'Ada Lovelace']),
+])
+def test_search_matches_word_prefixes(store, query, expected):
+    rows, total = store.select_page('a', 'history', 0, 10, query=query)
+    assert names(rows) == expected
+    assert total == len(expected)
+
+
+def test_deleted_entries_leave_the_search_index(store):
+    rows, _ = store.select_page('a', 'history', 0, 10, query='ada')
+    store.delete_rows('a', 'history', rows[0]['id'])
+    assert store.select_page('a', 'history', 0, 10, query='ada') == ([], 0)
+    assert store.select_page('a', 'history', 0, 10)[1] == 2
+
+    store.delete_rows('a', 'history')
+    assert store.select_page('a', 'history', 0, 10)[1] == 0
+    assert store.select_page('a', 'favorite', 0, 10)[1] == 1
+    assert store.db.execute('SELECT COUNT(*) FROM entries_fts').fetchone()[0] == 2
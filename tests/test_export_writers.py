@@ -0,0 +1,74 @@
+import csv
+import gzip
+import io
+import json
+import sqlite3
+
+import main
+
+
+TRICKY = [
+    {'full_name': "Conan O'Brien", 'address': '1 Main St, Apt "B"\nSpringfield', 'age': 42, 'active': True,
+     'traits': ['tall', 'funny'], 'owner': {'name': 'Ada'}, 'note': None},
+    {'full_name': 'Robert"); DROP TABLE people;--', 'address': '', 'age': 3.5, 'active': False,
+     'traits': [], 'owner': {}, 'note': 'x'},
+]
+
+
+def load_sql(text):
+    db = sqlite3.connect(':memory:')
+    db.executescript(text)
+    return db
+
+
+def test_csv_escapes_separators_quotes_and_newlines():
+    f = io.StringIO(newline='')
+    assert main.write_csv(iter(TRICKY), f) == 2
+    rows = list(csv.DictReader(io.StringIO(f.getvalue(), newline='')))
+    assert rows[0]['full_name'] == "Conan O'Brien"
+    assert rows[0]['address'] == '1 Main St, Apt "B"\nSpringfield'
+    assert json.loads(rows[0]['traits']) == ['tall', 'funny']
+    assert json.loads(rows[0]['owner']) == {'name': 'Ada'}
+    assert (rows[0]['age'], rows[0]['active'], rows[0]['note']) == ('42', 'True', '')
+
+
+def test_sql_escapes_values_and_identifiers():
+    f = io.StringIO()
+    main.write_sql(iter(TRICKY), f, fieldnames=[*TRICKY[0], 'we"ird'])
+    db = load_sql(f.getvalue())
+    rows = db.execute('SELECT full_name, address, age, active, traits, note, "we""ird" FROM people ORDER BY id').fetchall()
+    # Every column is TEXT, so numbers and booleans come back as text
+    assert rows[0] == ("Conan O'Brien", '1 Main St, Apt "B"\nSpringfield', '42', '1', '["tall", "funny"]', None, None)
+    assert rows[1][:2] == ('Robert"); DROP TABLE people;--', '')
+    assert rows[1][2:4] == ('3.5', '0')
+
+
+def test_sql_inserts_are_chunked():
+    records = [{'full_name': f'Person {i}'} for i in range(5)]
+    f = io.StringIO()
+    assert main.write_sql(iter(records), f, chunk_rows=2) == 5
+    assert f.getvalue().count('INSERT INTO') == 3
+    assert load_sql(f.getvalue()).execute('SELECT COUNT(*) FROM people').fetchone() == (5,)
+
+
+def test_sql_keeps_a_records_own_id():
+    f = io.StringIO()
+    main.write_sql(iter([{'id': 7, 'name': 'Rex'}, {'id': 9, 'name': 'Tom'}]), f, table='pets')
+    assert 'AUTOINCREMENT' not in f.getvalue()
+    assert load_sql(f.getvalue()).execute('SELECT id, name FROM pets').fetchall() == [('7', 'Rex'), ('9', 'Tom')]
+
+
+def test_empty_exports():
+    f = io.StringIO()
+    assert main.write_sql(iter([]), f) == 0
+    assert f.getvalue() == ''
+    f = io.StringIO()
+    assert main.write_json(iter([]), f, extra={'story': {'title': 'T'}}) == 0
+    assert json.loads(f.getvalue()) == {'people': [], 'story': {'title': 'T'}}
+
+
+def test_write_export_compresses(tmp_path):
+    path = str(tmp_path / 'people.jsonl.gz')
+    assert main.write_export(iter(TRICKY), path, 'jsonl', compress=True) == 2
+    with gzip.open(path, 'rt') as f:
+        assert [json.loads(line) for line in f] == TRICKY
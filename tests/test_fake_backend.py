@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+import main
+
+
+def people(text):
+    return json.loads(text)['people']
+
+
+def test_same_seed_gives_same_answers():
+    prompt = main.build_people_prompt('regular', 3)
+    first, second = main.FakeBackend(latency=0, seed=7), main.FakeBackend(latency=0, seed=7)
+    assert [first.build_response(prompt, 'regular', 3) for _ in range(3)] == \
+        [second.build_response(prompt, 'regular', 3) for _ in range(3)]
+
+
+def test_repeated_prompt_gets_new_answer():
+    backend = main.FakeBackend(latency=0)
+    prompt = main.build_people_prompt('regular', 3)
+    assert backend.build_response(prompt, 'regular', 3) != backend.build_response(prompt, 'regular', 3)
+
+
+def test_seeded_request_ignores_history():
+    prompt = main.build_people_prompt('regular', 3)
+    used = main.FakeBackend(latency=0)
+    used.build_response(prompt, 'regular', 3)
+    assert used.build_response(prompt, 'regular', 3, seed=1) == \
+        main.FakeBackend(latency=0).build_response(prompt, 'regular', 3, seed=1)
+
+
+def test_prompt_counts_are_bounded():
+    backend = main.FakeBackend(latency=0, max_prompts=3)
+    for count in range(1, 11):
+        backend.build_response(main.build_people_prompt('regular', count), 'regular', count)
+    assert len(backend.prompt_counts) == 3
+    assert main.build_people_prompt('regular', 10) in backend.prompt_counts
+
+
+def test_answers_match_their_schema():
+    backend = main.FakeBackend(latency=0)
+    for mode in ('regular', 'fantasy', 'surprise'):
+        prompt = main.build_people_prompt(mode, 5)
+        response = asyncio.run(backend.generate(prompt, mode, 5))
+        assert len(main.validate_records(mode, people(response.text))) == 5
+
+
+def test_truncated_answer_is_salvaged():
+    backend = main.FakeBackend(latency=0, truncation_rate=1)
+    text = backend.respond(main.build_people_prompt('regular', 5), 'regular', 5)
+    salvaged = main.salvage_people(text)
+    assert len(salvaged) < 5
+    assert salvaged == people(main.FakeBackend(latency=0).build_response(
+        main.build_people_prompt('regular', 5), 'regular', 5))[:len(salvaged)]
@@ -0,0 +1,93 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sqlite3
+
+import pytest
+
+import main
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def restore_cli_globals(monkeypatch):
+    # run_generate_command replaces these for the length of a run
+    monkeypatch.setattr(main, 'generation_limiter', main.generation_limiter)
+    monkeypatch.setattr(main, 'REGULAR_GENERATOR', main.REGULAR_GENERATOR)
+
+
+def run(*argv):
+    asyncio.run(main.run_generate_command(main.parse_generate_args(list(argv))))
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_interrupted_run_resumes_from_checkpoint(tmp_path, monkeypatch):
+    out = str(tmp_path / 'people.jsonl')
+    argv = ('--count', '40', '--out', out, '--checkpoint-every', '10', '--shard-size', '5')
+    original = main.stream_batch
+    chunks = []
+
+    def crash_in_third_chunk(*args, **kwargs):
+        async def batch():
+            chunks.append(kwargs['shard_offset'])
+            async for index, person in aiter_enumerate(original(*args, **kwargs)):
+                if len(chunks) == 3 and index == 4:
+                    raise Crash()
+                yield person
+        return batch()
+
+    monkeypatch.setattr(main, 'stream_batch', crash_in_third_chunk)
+    with pytest.raises(Crash):
+        run(*argv)
+    with open(f'{out}.checkpoint.json') as f:
+        assert json.load(f)['written'] == 20
+    checkpointed = read_lines(out)[:20]
+    assert len(read_lines(out)) == 24
+
+    monkeypatch.setattr(main, 'stream_batch', original)
+    run(*argv)
+    people = read_lines(out)
+    assert len(people) == 40
+    assert people[:20] == checkpointed
+    assert len({main.person_key(person) for person in people}) == 40
+    assert not os.path.exists(f'{out}.checkpoint.json')
+
+
+def test_checkpoint_of_another_run_is_refused(tmp_path):
+    out = str(tmp_path / 'people.jsonl')
+    with open(f'{out}.checkpoint.json', 'w') as f:
+        json.dump({'mode': 'fantasy', 'count': 5, 'written': 0, 'bytes': 0, 'next_shard': 0}, f)
+    with pytest.raises(SystemExit, match='different run'):
+        run('--count', '5', '--out', out)
+
+
+def test_other_formats_are_streamed_from_the_work_file(tmp_path):
+    csv_out = str(tmp_path / 'people.csv.gz')
+    run('--count', '12', '--out', csv_out, '--format', 'csv', '--compress', '--shard-size', '5')
+    with gzip.open(csv_out, 'rt', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 12
+    assert not os.path.exists(f'{csv_out}.partial.jsonl')
+    assert not os.path.exists(f'{csv_out}.checkpoint.json')
+
+    sql_out = str(tmp_path / 'people.sql')
+    run('--count', '12', '--out', sql_out, '--format', 'sql', '--shard-size', '5')
+    with sqlite3.connect(':memory:') as db, open(sql_out) as f:
+        db.executescript(f.read())
+        assert db.execute('SELECT COUNT(*) FROM people').fetchone() == (12,)
+
+
+async def aiter_enumerate(items):
+    index = 0
+    async for item in items:
+        yield index, item
+        index += 1
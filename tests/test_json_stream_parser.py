@@ -0,0 +1,38 @@
+import main
+
+TEXT = 'Here you go!\n```json\n{"people": [{"full_name": "Ada \\"A\\" Lovelace", "tags": [1, 2]}, {"full_name": "Bram"}]}\n```'
+
+
+def feed_in_chunks(text, size):
+    parser = main.JsonStreamParser()
+    events = []
+    for start in range(0, len(text), size):
+        events += parser.feed(text[start:start + size])
+    return parser, events
+
+
+def test_people_complete_as_they_arrive():
+    for size in (1, 3, 7, len(TEXT)):
+        parser, events = feed_in_chunks(TEXT, size)
+        assert events == [
+            (('people', 0), {'full_name': 'Ada "A" Lovelace', 'tags': [1, 2]}),
+            (('people', 1), {'full_name': 'Bram'}),
+        ]
+        assert parser.done
+
+
+def test_root_is_parsed_without_the_surrounding_prose():
+    parser, _ = feed_in_chunks(TEXT, 5)
+    assert parser.parse_root() == {'people': [{'full_name': 'Ada "A" Lovelace', 'tags': [1, 2]}, {'full_name': 'Bram'}]}
+
+
+def test_bare_array_yields_items():
+    _, events = feed_in_chunks('[{"a": 1}, {"a": 2}]', 4)
+    assert [(path, value) for path, value in events if len(path) == 1] == [((0,), {'a': 1}), ((1,), {'a': 2})]
+
+
+def test_incomplete_input_keeps_only_finished_people():
+    parser, events = feed_in_chunks('{"people": [{"full_name": "Ada"}, {"full_na', 6)
+    assert events == [(('people', 0), {'full_name': 'Ada'})]
+    assert not parser.done
+    assert main.salvage_people('{"people": [{"full_name": "Ada"}, {"full_na') == [{'full_name': 'Ada'}]
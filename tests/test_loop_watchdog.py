@@ -0,0 +1,31 @@
+import sys
+
+import main
+
+# Compiled as if it were part of main.py, since describe() only looks at that file's frames
+FRAMES = compile('''
+def handler(mode, widget):
+    return blocking(widget)
+
+def blocking(mode):
+    return sys._getframe()
+''', main.__file__, 'exec')
+
+
+def frame_for(mode, widget=None):
+    namespace = {'sys': sys}
+    exec(FRAMES, namespace)
+    return namespace['handler'](mode, widget)
+
+
+def test_stall_names_the_call_site_handler_and_mode():
+    stall = main.LoopWatchdog.describe(frame_for('fantasy'))
+    assert stall['site'] == f'{main.__file__.rsplit("/", 1)[-1]}:6 blocking'
+    assert (stall['handler'], stall['mode']) == ('handler', 'fantasy')
+
+
+def test_a_mode_that_is_not_a_name_is_left_out():
+    # main_page's mode is a ui.select
+    widget = object()
+    assert main.LoopWatchdog.describe(frame_for(widget, widget))['mode'] is None
+    assert main.LoopWatchdog.describe(frame_for('regular', widget))['mode'] == 'regular'
@@ -0,0 +1,86 @@
+import pytest
+
+import main
+
+
+PETS = main.RecordSchema('pets', {
+    'name': 'string', 'age': 'integer', 'weight': 'number', 'vaccinated': 'boolean', 'toys': ['string'],
+    'owner': {'full_name': 'string', 'visits': ['integer']}, 'friends': [{'name': 'string'}]
+})
+
+
+def pet(**overrides):
+    record = {
+        'name': 'Biscuit', 'age': 3, 'weight': 4.5, 'vaccinated': True, 'toys': ['ball'],
+        'owner': {'full_name': 'Ada Lovelace', 'visits': [1]}, 'friends': [{'name': 'Rex'}]
+    }
+    record.update(overrides)
+    return record
+
+
+def test_a_string_becomes_a_list():
+    valid, _ = PETS.validate_batch([pet(toys='ball, rope ,bone')])
+    assert valid[0]['toys'] == ['ball', 'rope', 'bone']
+    valid, _ = main.RECORD_SCHEMAS['fantasy'].validate_batch([{
+        'full_name': 'Ser Bram', 'title': 'Knight', 'age': '40', 'origin': 'Vale', 'occupation': 'Guard',
+        'special_traits': 'brave', 'equipment': ['sword'], 'relationships': {'type': 'rival', 'to': 'Lyra'},
+        'backstory': 'Long ago.'
+    }])
+    assert valid[0]['special_traits'] == ['brave']
+    assert valid[0]['relationships'] == [{'type': 'rival', 'to': 'Lyra'}]
+
+
+def test_numbers_written_as_text_are_repaired():
+    valid, rejected = PETS.validate_batch([pet(age='about 7 years', weight='2.25 kg', vaccinated='Yes', name=12)])
+    assert not rejected
+    assert (valid[0]['age'], valid[0]['weight'], valid[0]['vaccinated'], valid[0]['name']) == (7, 2.25, True, '12')
+
+
+def test_list_items_that_do_not_fit_are_dropped():
+    valid, _ = PETS.validate_batch([pet(owner={'full_name': 'Ada', 'visits': ['3', 'often', 5]})])
+    assert valid[0]['owner']['visits'] == [3, 5]
+
+
+@pytest.mark.parametrize('overrides, reason', [
+    ({'name': None}, 'missing name'),
+    ({'name': '  '}, 'name: expected a non-empty string'),
+    ({'age': 'unknown'}, 'age: expected a number'),
+    ({'vaccinated': 'maybe'}, 'vaccinated: expected true or false'),
+    ({'toys': []}, 'toys: expected a non-empty list'),
+    ({'owner': 'Ada'}, 'owner: expected an object'),
+    ({'owner': {'visits': [1]}}, 'owner: missing full_name'),
+])
+def test_records_that_cannot_be_repaired_are_rejected(overrides, reason):
+    record = pet(**overrides)
+    valid, rejected = PETS.validate_batch([record, pet()])
+    assert len(valid) == 1
+    assert rejected == [(record, reason)]
+
+
+def test_nested_objects_keep_schema_order_and_drop_unknown_keys():
+    valid, _ = PETS.validate_batch([pet(owner={'visits': 2, 'nickname': 'A', 'full_name': 'Ada'}, extra='x')])
+    assert 'extra' not in valid[0]
+    assert list(valid[0]['owner'].items()) == [('full_name', 'Ada'), ('visits', [2])]
+
+
+def test_compiled_schema_and_prompt_fragment():
+    assert PETS.prompt_fragment == (
+        'Each record: {name, age: integer, weight: number, vaccinated: boolean, toys: [string], '
+        'owner: {full_name, visits: [integer]}, friends: [{name}]}.'
+    )
+    owner = PETS.item_schema['properties']['owner']
+    assert owner['required'] == ['full_name', 'visits']
+    assert owner['properties']['visits'] == {'type': 'array', 'items': {'type': 'integer'}}
+    with pytest.raises(ValueError, match='Invalid field type'):
+        main.RecordSchema('broken', {'name': 'date'})
+
+
+def test_validate_records_counts_what_it_drops():
+    series = main.metrics.series('invalid_records_total', {'mode': 'regular'})
+    before = main.metrics.counters.get(series, 0)
+    people = main.validate_records('regular', [
+        {'full_name': 'Ada', 'email': 'ada@example.com', 'address': '1 Road', 'phone_number': 5550100, 'occupation': 'Poet'},
+        {'full_name': 'Bob', 'email': 'bob@example.com'},
+    ])
+    assert [person['phone_number'] for person in people] == ['5550100']
+    assert main.metrics.counters[series] == before + 1
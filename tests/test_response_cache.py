@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def disk_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.db')
+    monkeypatch.setattr(main, 'response_cache', main.ResponseCache(db_path=path))
+    return path
+
+
+def generate(prompt):
+    return asyncio.run(main.generate_content(prompt, mode='regular', count=2)).text
+
+
+def test_same_backend_hits_the_cache(disk_cache):
+    prompt = main.build_people_prompt('regular', 2)
+    assert generate(prompt) == generate(prompt)
+    assert main.response_cache.stats['hits'] == 1
+
+
+def test_switching_backend_misses_the_cache(disk_cache, monkeypatch):
+    prompt = main.build_people_prompt('regular', 2)
+    generate(prompt)
+    # A restart under another backend reads the same SQLite tier
+    monkeypatch.setattr(main, 'response_cache', main.ResponseCache(db_path=disk_cache))
+    monkeypatch.setattr(main, 'MODEL_BACKEND', 'replay')
+    generate(prompt)
+    assert main.response_cache.stats == {**main.response_cache.stats, 'hits': 0, 'misses': 1}
+
+    monkeypatch.setattr(main, 'MODEL_BACKEND', 'fake')
+    generate(prompt)
+    assert main.response_cache.stats['disk_hits'] == 1
+
+
+def test_concurrent_disk_reads_and_writes(tmp_path):
+    # One entry in memory, so nearly every lookup goes to the shared SQLite connection
+    cache = main.ResponseCache(max_entries=1, db_path=str(tmp_path / 'cache.db'))
+
+    async def run():
+        await asyncio.gather(*(cache.put(f'key{i}', f'text{i}') for i in range(200)))
+        return await asyncio.gather(*(cache.get(f'key{i}') for i in range(200)))
+
+    assert asyncio.run(run()) == [f'text{i}' for i in range(200)]
+    assert cache.stats['disk_hits'] >= 199
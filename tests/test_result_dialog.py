@@ -0,0 +1,39 @@
+import asyncio
+
+from nicegui import Client
+from nicegui.page import page
+
+import main
+
+
+def test_large_batches_render_a_preview_and_let_others_run(monkeypatch):
+    monkeypatch.setattr(main, 'DIALOG_PREVIEW_ENTRIES', 10)
+    monkeypatch.setattr(main, 'STREAM_YIELD_EVERY', 5)
+    rendered = []
+    monkeypatch.setattr(main, 'render_person', lambda person, index, mode='Regular': rendered.append(index))
+
+    async def people():
+        # Never suspends on its own, like a cached or local source
+        for i in range(40):
+            yield {'full_name': f'Person {i}', 'email': f'p{i}@example.com'}
+
+    async def run():
+        beats = 0
+
+        async def beat():
+            nonlocal beats
+            while True:
+                await asyncio.sleep(0)
+                beats += 1
+
+        task = asyncio.create_task(beat())
+        with Client(page('/test-dialog')):
+            data = await main.stream_into_dialog(main.SessionState('test'), people())
+        task.cancel()
+        return data, beats
+
+    data, beats = asyncio.run(run())
+    assert len(data['people']) == 40
+    assert rendered == list(range(10))
+    assert beats >= 40 // 5 - 1
+    assert main.hidden_entries_text(40).startswith('...and 30 more')
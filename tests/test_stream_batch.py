@@ -0,0 +1,48 @@
+import asyncio
+
+import main
+
+
+def test_top_up_rounds_exclude_the_most_recent_people(monkeypatch):
+    monkeypatch.setattr(main, 'TOPUP_EXCLUDE_LIMIT', 3)
+    excludes = []
+
+    async def stream_people(mode, size, shard=0, exclude=None, **kwargs):
+        excludes.append(exclude)
+        # The first round repeats a person, so a top-up round is needed
+        for i in ([0, 1, 2, 3, 3, 3] if shard == 0 else range(size)):
+            yield {'full_name': f'Person {shard}-{i}', 'email': f'p{shard}-{i}@example.com'}
+
+    async def collect():
+        return [person async for person in main.stream_batch('regular', 6, shard_size=6, use_cache=False,
+                                                             seen={('earlier', 'earlier@example.com')})]
+
+    monkeypatch.setattr(main, 'stream_people', stream_people)
+    people = asyncio.run(collect())
+    assert len(people) == 6
+    assert excludes[0] is None
+    # Only this batch's people, oldest first, capped at the limit
+    assert excludes[1] == tuple(main.person_key(person) for person in people[1:4])
+
+
+def test_local_batches_let_other_tasks_run(monkeypatch):
+    monkeypatch.setattr(main, 'REGULAR_GENERATOR', 'local')
+    monkeypatch.setattr(main, 'STREAM_YIELD_EVERY', 10)
+
+    async def run():
+        beats = 0
+
+        async def beat():
+            nonlocal beats
+            while True:
+                await asyncio.sleep(0)
+                beats += 1
+
+        task = asyncio.create_task(beat())
+        people = [person async for person in main.stream_batch('regular', 100, seed=1)]
+        task.cancel()
+        return people, beats
+
+    people, beats = asyncio.run(run())
+    assert len(people) == 100
+    assert beats >= 10
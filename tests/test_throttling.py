@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import main
+
+
+def test_disabled_bucket_never_waits():
+    bucket = main.TokenBucket(0)
+
+    async def drain():
+        for _ in range(1000):
+            await bucket.acquire(100)
+
+    started = time.monotonic()
+    asyncio.run(drain())
+    assert time.monotonic() - started < 0.5
+
+
+def test_bucket_waits_for_refill():
+    bucket = main.TokenBucket(6000)
+
+    async def drain():
+        await bucket.acquire(6000)
+        started = time.monotonic()
+        await bucket.acquire(10)
+        return time.monotonic() - started
+
+    assert 0.05 <= asyncio.run(drain()) < 1
+
+
+def test_debit_can_overdraw():
+    bucket = main.TokenBucket(6000)
+    bucket.debit(6100)
+    assert bucket.tokens < 0
+
+
+def test_limit_halves_once_per_cooldown_and_grows_back():
+    limiter = main.AdaptiveConcurrency(max_limit=8, cooldown=60)
+    limiter.record_failure()
+    limiter.record_failure()
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.record_success()
+    assert limiter.limit == 5
+    for _ in range(100):
+        limiter.record_success()
+    assert limiter.limit == 8
+
+
+def test_limit_never_drops_below_minimum():
+    limiter = main.AdaptiveConcurrency(max_limit=4, min_limit=2, cooldown=0)
+    for _ in range(5):
+        limiter.record_failure()
+    assert limiter.limit == 2
+
+
+def test_calls_in_flight_stay_within_limit():
+    limiter = main.AdaptiveConcurrency(max_limit=3)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter:
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(call() for _ in range(20)))
+
+    asyncio.run(run())
+    assert peak == 3
+    assert limiter.in_flight == 0